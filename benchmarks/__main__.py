@@ -0,0 +1,49 @@
+# Runs every benchmark and writes the results as JSON.
+#   python -m benchmarks [--output results.json] [--scale N] [--only parse]
+import argparse
+import json
+import platform
+import sys
+import time
+
+from . import bench_dispatch, bench_end_to_end, bench_framing, bench_parse
+from .common import print_results
+
+SUITES = {
+    'framing': bench_framing,
+    'parse': bench_parse,
+    'dispatch': bench_dispatch,
+    'end_to_end': bench_end_to_end,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument('--scale', type=int, default=1,
+                        help='multiply the number of iterations')
+    parser.add_argument('--only', action='append', choices=sorted(SUITES),
+                        help='run only these suites')
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in args.only or sorted(SUITES):
+        results.extend(SUITES[name].run(args.scale))
+    print_results(results)
+
+    report = {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
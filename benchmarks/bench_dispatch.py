@@ -0,0 +1,45 @@
+# Per message handling in Server, Client and Runs without any socket.
+#   python -m benchmarks.bench_dispatch
+from dcss.client import Client
+from dcss.runs import Runs
+from dcss.server import Server
+
+from .common import bench, print_results
+
+RUN1 = ('stog_configure_string run1 self inactive 0 1 test /data/test 1 Phi '
+        '0.0 180.0 1.0 180 1.0 300.0 40.0 0.0 1 12658.0 0.0 0.0 0.0 0.0 0 0')
+
+
+class BenchDHS(Server):
+    def stoh_register_operation(self, *args):
+        pass
+
+
+def run(scale=1):
+    number = 50000 * scale
+    dhs = BenchDHS('bench', 'localhost')
+    client = Client('localhost', 'bench')
+    runs = Runs('localhost', 'bench')
+    changing = [RUN1.replace(' 1.0 300.0', ' %d 300.0' % i) for i in range(2)]
+    return [
+        bench('server.handle_message[handled]',
+              lambda: dhs.handle_message('stoh_register_operation a a'),
+              number),
+        bench('server.handle_message[unhandled]',
+              lambda: dhs.handle_message(
+                  'stog_update_motor_position sample_x 1.0 normal'),
+              number),
+        bench('client._process_message[motor]',
+              lambda: client._process_message(
+                  'stog_update_motor_position sample_x 1.0 normal'),
+              number),
+        bench('runs._process_message[unchanged]',
+              lambda: runs._process_message(RUN1), number),
+        bench('runs._process_message[changed]',
+              lambda: [runs._process_message(msg) for msg in changing],
+              number // 2),
+    ]
+
+
+if __name__ == '__main__':
+    print_results(run())
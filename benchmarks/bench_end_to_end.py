@@ -0,0 +1,55 @@
+# Operations per second and round trip latency against the local simulator.
+#   python -m benchmarks.bench_end_to_end
+import time
+
+from dcss.client import Client
+from dcss.simulator import Simulator
+
+from .common import print_results
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run(scale=1):
+    count = 1000 * scale
+    results = []
+    with Simulator(gui_port=0, hardware_port=0) as simulator:
+        client = Client('127.0.0.1', 'bench')
+        client.port = simulator.gui_port
+        client.run_operation('warmup')
+
+        latencies = []
+        for _ in range(count):
+            start = time.perf_counter()
+            client.run_operation('bench')
+            latencies.append(time.perf_counter() - start)
+        total = sum(latencies)
+        results.append({
+            'name': 'end_to_end.run_operation[sequential]',
+            'calls': count,
+            'us_per_call': 1e6 * total / count,
+            'calls_per_sec': count / total,
+            'p50_us': 1e6 * percentile(latencies, 0.5),
+            'p99_us': 1e6 * percentile(latencies, 0.99),
+        })
+
+        start = time.perf_counter()
+        futures = [client.run_operation('bench', wait=False)
+                   for _ in range(count)]
+        client.wait_for_operations(futures)
+        total = time.perf_counter() - start
+        results.append({
+            'name': 'end_to_end.run_operation[pipelined]',
+            'calls': count,
+            'us_per_call': 1e6 * total / count,
+            'calls_per_sec': count / total,
+        })
+        client.close()
+    return results
+
+
+if __name__ == '__main__':
+    print_results(run())
@@ -0,0 +1,40 @@
+# Frame decoding, alone and through DCSS.read_message on a socket pair.
+#   python -m benchmarks.bench_framing
+import socket
+import threading
+
+from dcss.dcss import DCSS
+from dcss.framing import FrameDecoder, encode_xos3
+
+from .common import bench, print_results
+
+MESSAGE = 'stog_update_motor_position sample_x 1.2345 normal'
+
+
+def run(scale=1):
+    count = 10000 * scale
+    stream = encode_xos3(MESSAGE) * count
+    results = []
+
+    def decode_all():
+        FrameDecoder().feed(stream)
+    result = bench('framing.FrameDecoder.feed', decode_all, 3)
+    result['name'] = 'framing.FrameDecoder.feed[per frame]'
+    result['us_per_call'] /= count
+    result['calls_per_sec'] *= count
+    results.append(result)
+
+    ours, theirs = socket.socketpair()
+    dcss = DCSS()
+    dcss.socket = ours
+    writer = threading.Thread(target=theirs.sendall, args=(stream * 3, ))
+    writer.start()
+    results.append(bench('dcss.DCSS.read_message', dcss.read_message, count))
+    writer.join()
+    ours.close()
+    theirs.close()
+    return results
+
+
+if __name__ == '__main__':
+    print_results(run())
@@ -0,0 +1,51 @@
+# Compares dcss.parse.parse_message with the per message type parsers.
+#   python -m benchmarks.bench_parse
+from dcss import parse
+
+from .common import bench, print_results
+
+CASSETTE = ('stog_set_string_completed robot_cassette normal ' +
+            'X ' + 'b ' * 96 + '3 ' + '1 j ' * 48 + 'u ' * 97)
+FORCES = ('stog_set_string_completed robot_force_middle normal -65.8 ' +
+          '0.0 uuuu 0.3 EEEE ' * 24)
+PROBE = ('stog_start_operation robot_config 31.41 probe ' +
+         '1 ' + '0 ' * 96 + '0 ' + '1 ' * 96 + '0 ' * 97)
+
+MESSAGES = [
+    (parse.parse_start_operation,
+     'stog_start_operation robot_config 31.2 set_port_state mX0 u'),
+    (parse.parse_operation_update,
+     'stog_operation_update robot_config 31.38 port jam at m 3 A'),
+    (parse.parse_operation_completed,
+     'stog_operation_completed robot_config 31.41 aborted'),
+    (parse.parse_holder_found_message,
+     'stog_operation_update robot_config 31.4 '
+     'found calibration cassette l dz: -0.300'),
+]
+ROBOT_MESSAGES = [
+    (parse.parse_robot_cassette_message, CASSETTE),
+    (parse.parse_robot_force_message, FORCES),
+    (parse.parse_start_robot_probe_message, PROBE),
+]
+
+
+def run(scale=1):
+    results = []
+    number = 20000 * scale
+    for func, message in MESSAGES:
+        results.append(bench('parse.' + func.__name__,
+                             lambda: func(message), number))
+        if func is not parse.parse_holder_found_message:
+            results.append(bench('parse.parse_message[%s]' % func.__name__[6:],
+                                 lambda: parse.parse_message(message), number))
+    for func, message in ROBOT_MESSAGES:
+        results.append(bench('parse.' + func.__name__,
+                             lambda: func(message), number // 10))
+        results.append(bench('parse.%s[compact]' % func.__name__,
+                             lambda: func(message, compact=True),
+                             number // 10))
+    return results
+
+
+if __name__ == '__main__':
+    print_results(run())
@@ -0,0 +1,18 @@
+import timeit
+
+
+def bench(name, func, number, repeat=3):
+    """Best of repeat runs of func called number times, as a result dict"""
+    seconds = min(timeit.repeat(func, number=number, repeat=repeat))
+    return {
+        'name': name,
+        'calls': number,
+        'us_per_call': 1e6 * seconds / number,
+        'calls_per_sec': number / seconds,
+    }
+
+
+def print_results(results):
+    for result in results:
+        print('%-44s %12.3f us %14.0f /s' % (
+            result['name'], result['us_per_call'], result['calls_per_sec']))
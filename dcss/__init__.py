@@ -1,7 +1,7 @@
 from .client import Client
 from .server import Server
 from .runs import Runs
-from .dcss import DCSS
+from .dcss import DCSS, DCSSError, Disconnected, ReconnectPolicy, Timeout
 
 
 def debug_client():
@@ -10,4 +10,5 @@ def debug_client():
 
 
 __version__ = '2.0.0'
-__all__ = ('Client', 'Server', 'Runs', 'DCSS', 'debug_client')
+__all__ = ('Client', 'Server', 'Runs', 'DCSS', 'DCSSError', 'Disconnected',
+           'ReconnectPolicy', 'Timeout', 'debug_client')
@@ -0,0 +1,259 @@
+# asyncio versions of Client and Server, many of these can share one loop
+import asyncio
+import logging
+from collections import Counter
+
+from .dcss import Disconnected, ReconnectPolicy
+from .framing import FrameDecoder, encode_xos1, encode_xos3
+from .server import OperationHandle, handler_table
+
+
+class XOSProtocol(asyncio.BufferedProtocol):
+    """Feeds received bytes straight into the decoder of an AsyncDCSS"""
+
+    def __init__(self, dcss):
+        self.dcss = dcss
+
+    def connection_made(self, transport):
+        self.dcss.transport = transport
+
+    def get_buffer(self, sizehint):
+        return self.dcss.decoder.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        for msg, data in self.dcss.decoder.buffer_updated(nbytes):
+            self.dcss._handle_frame(msg, data)
+
+    def connection_lost(self, exc):
+        self.dcss._connection_lost(exc)
+
+
+class AsyncDCSS(object):
+    # number of leading XOS1 frames sent by dcss on each connection
+    xos1_frames = 0
+
+    def __init__(self, server=None, port=None, read_size=65536,
+                 reconnect_policy=None):
+        self.server = server
+        self.port = port
+        self.read_size = read_size
+        if reconnect_policy is None:
+            reconnect_policy = ReconnectPolicy()
+        self.reconnect_policy = reconnect_policy
+
+        self.loop = None
+        self.transport = None
+        self.decoder = None
+        # resolved when the connection is lost
+        self.closed = None
+        # (prefixes, future) pairs resolved by the next matching message
+        self.waiters = []
+
+        self.log = logging.getLogger('DCSS')
+
+        # Instance variable for dcss login status
+        self.dcss_client_loggedin = False
+
+    async def connect(self):
+        self.loop = asyncio.get_running_loop()
+        for delay in self.reconnect_policy.delays():
+            await asyncio.sleep(delay)
+            self.decoder = FrameDecoder(self.xos1_frames, self.read_size)
+            # register before connecting so the greeting can not be missed
+            greeting = self.wait_for('stoc_send_client_type')
+            self.closed = self.loop.create_future()
+            try:
+                self.log.info("Connecting to %s:%s", self.server, self.port)
+                await self.loop.create_connection(lambda: XOSProtocol(self),
+                                                  self.server, self.port)
+            except OSError:
+                greeting.cancel()
+                self.waiters.clear()
+                # Failure
+                self.log.error('Failed to connect to %s:%s',
+                               self.server, self.port)
+            else:
+                # Success
+                self.log.info("Connected to %s:%s", self.server, self.port)
+                await greeting
+                await self.login()
+                return
+        raise Disconnected('Unable to connect to %s:%s' %
+                           (self.server, self.port))
+
+    async def login(self):
+        raise Exception('Must overide')
+
+    def close(self):
+        self.dcss_client_loggedin = False
+        if self.transport is not None:
+            self.transport.close()
+
+    def wait_for(self, prefixes):
+        """Future for the next message starting with any of prefixes"""
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((prefixes, future))
+        return future
+
+    async def process_until(self, msg_to_stop_on):
+        return await self.wait_for(msg_to_stop_on)
+
+    def _write(self, packet):
+        if self.transport is None:
+            self.log.info('Cannot send, not yet connected to dcss server at %s:%s',
+                          self.server, self.port)
+            return
+        # handlers may send from executor threads
+        self.loop.call_soon_threadsafe(self.transport.write, packet)
+
+    def send_xos1(self, msg):
+        self.log.debug('sending xos1: %r', msg)
+        self._write(encode_xos1(msg))
+
+    def send_xos3(self, msg, data=b''):
+        self.log.debug('sending xos3: %r', msg)
+        self._write(encode_xos3(msg, data))
+
+    def _handle_frame(self, msg, data):
+        msg = msg.rstrip(b'\0').decode('utf-8')
+        self.log.debug('received: %r', msg)
+        # process every message internally
+        self._process_message(msg)
+        if self.waiters:
+            waiters = []
+            for prefixes, future in self.waiters:
+                if future.done():
+                    continue
+                if msg.startswith(prefixes):
+                    future.set_result(msg)
+                else:
+                    waiters.append((prefixes, future))
+            self.waiters = waiters
+
+    def _connection_lost(self, exc):
+        self.log.info('Disconnected by dcss server at %s:%s',
+                      self.server, self.port)
+        self.transport = None
+        self.dcss_client_loggedin = False
+        for _, future in self.waiters:
+            if not future.done():
+                future.set_exception(Disconnected('Disconnected from dcss'))
+        self.waiters = []
+        if self.closed is not None and not self.closed.done():
+            self.closed.set_result(exc)
+
+    def _process_message(self, msg):
+        pass
+
+
+class AsyncClient(AsyncDCSS):
+    def __init__(self, server, session_id, **kwargs):
+        super(AsyncClient, self).__init__(server=server, port=14243, **kwargs)
+
+        self.master = False
+        self.ready = False
+        self.client_id = None
+        self.operation_no = 0
+
+        # some vars for dcss
+        self.SID = session_id
+        self.user = 'blctl'
+        # dont actually need these but dcss wants them
+        self.host = 'who_cares'
+        self.display = ':0.0'
+
+    async def login(self):
+        complete = self.wait_for('stog_login_complete')
+        fmt = 'gtos_client_is_gui {0.user} {0.SID} {0.host} {0.display}'
+        self.send_xos1(fmt.format(self))
+        msg = await complete
+        self.client_id = msg.split()[1]
+        self.dcss_client_loggedin = True
+
+    def _process_message(self, msg):
+        if msg == 'stog_become_master':
+            self.master = True
+        if msg == 'stog_other_master' or msg == 'stog_become_slave':
+            self.master = False
+        if msg == 'stog_dcss_end_update_all_device':
+            self.ready = True
+
+    async def become_master(self, force=True):
+        if self.master:
+            return True
+
+        force_str = 'force'
+        if not force:
+            force_str = 'noforce'
+        answer = self.wait_for(('stog_become_master', 'stog_other_master',
+                                'stog_become_slave'))
+        self.send_xos3('gtos_become_master %s' % force_str)
+        return await answer == 'stog_become_master'
+
+    async def run_operation(self, name, *args):
+        if not await self.become_master():
+            raise Exception('Unable to become master!')
+
+        handle = '{}.{}'.format(self.client_id, self.operation_no)
+        self.operation_no += 1
+        completed = self.wait_for('stog_operation_completed %s %s ' %
+                                  (name, handle))
+        args = ' '.join(map(str, args))
+        self.send_xos3('gtos_start_operation %s %s %s' % (name, handle, args))
+        return await completed
+
+    async def set_string(self, string_name, data):
+        completed = self.wait_for('stog_set_string_completed %s ' % string_name)
+        self.send_xos3('gtos_set_string %s %s' % (string_name, data))
+        return await completed
+
+
+class AsyncServer(AsyncDCSS):
+    """Distributed Hardware Server running on asyncio.
+
+    Operation handlers may be coroutine functions, which run as tasks on the
+    loop, or plain functions, which run in the loop's default executor.
+    """
+
+    # dcss asks for our client type with a XOS1 message, the rest is XOS3
+    xos1_frames = 1
+
+    def __init__(self, name, server, **kwargs):
+        super(AsyncServer, self).__init__(server=server, port=14242, **kwargs)
+        self.name = name
+        self.tasks = set()
+        self.handlers = handler_table(self)
+        # counts of received message types we have no handler for
+        self.unhandled = Counter()
+
+    async def login(self):
+        self.send_xos1('htos_client_is_hardware %s' % self.name)
+        self.log.info("Logged in as hardware device '%s'", self.name)
+        self.dcss_client_loggedin = True
+
+    def _track(self, future):
+        self.tasks.add(future)
+        future.add_done_callback(self.tasks.discard)
+
+    def stoh_start_operation(self, name, handle, *args):
+        func = getattr(self, name, None)
+        if func is None:
+            self.log.warning('Operation %s is unhandled', name)
+            return
+        handler = OperationHandle(self, name, handle)
+        if asyncio.iscoroutinefunction(func):
+            self._track(asyncio.ensure_future(func(handler, *args)))
+        else:
+            self._track(self.loop.run_in_executor(None, func, handler, *args))
+
+    def _process_message(self, msg):
+        func_name, _, args = msg.partition(' ')
+        func = self.handlers.get(func_name)
+        if func is not None:
+            func(*args.split())
+        elif func_name:
+            self.unhandled[func_name] += 1
+
+    async def run(self):
+        await self.connect()
+        await self.closed
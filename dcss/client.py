@@ -1,28 +1,74 @@
 # DCS Protocol:
 # http://smb.slac.stanford.edu/research/developments/blu-ice/dcsAdmin4_1/node96.html
 # gui client
-from .dcss import DCSS
+import inspect
+from collections import deque
+from concurrent.futures import Future
+
+from .dcss import DCSS, Disconnected, make_deadline, remaining
+from .parse import parse_operation_completed, parse_operation_update
+from .state import DeviceState
+
+
+def _takes_timeout(func):
+    return 'timeout' in inspect.signature(func).parameters
 
 
 # small decorator to assure we are master before doing stuff
+# these decorators take the call's timeout, or else self.timeout, as one
+# deadline for their wait and the call. The call only gets what is left
+# of it if it has a timeout parameter.
 def master(func):
+    takes_timeout = _takes_timeout(func)
+
     def wrapper(self, *args, **kwargs):
-        if not self.become_master():
+        deadline = make_deadline(kwargs.pop('timeout', self.timeout))
+        if not self.become_master(timeout=remaining(deadline)):
             raise Exception('Unable to become master!')
+        if takes_timeout:
+            kwargs['timeout'] = remaining(deadline)
         return func(self, *args, **kwargs)
     return wrapper
 
 
 # make sure we have heard the full update before doing stuff
 def ready(func):
+    takes_timeout = _takes_timeout(func)
+
     def wrapper(self, *args, **kwargs):
+        deadline = make_deadline(kwargs.pop('timeout', self.timeout))
         while not self.ready:
-            self.read_message()
+            self.read_message(remaining(deadline))
+        if takes_timeout:
+            kwargs['timeout'] = remaining(deadline)
         return func(self, *args, **kwargs)
     return wrapper
 
 
+# only wait until the named strings, motors or shutters have been heard
+def needs(*names):
+    def decorator(func):
+        takes_timeout = _takes_timeout(func)
+
+        def wrapper(self, *args, **kwargs):
+            deadline = make_deadline(kwargs.pop('timeout', self.timeout))
+            self.wait_for_devices(names, remaining(deadline))
+            if takes_timeout:
+                kwargs['timeout'] = remaining(deadline)
+            return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
 class Client(DCSS):
+    # logging in, master and ready tracking, operations and strings
+    internal_prefixes = (
+        b'stoc_send_client_type', b'stog_login_complete',
+        b'stog_become_master', b'stog_other_master', b'stog_become_slave',
+        b'stog_dcss_end_update_all_device', b'stog_operation_completed',
+        b'stog_configure_string', b'stog_set_string_completed',
+    )
+
     def __init__(self, server, session_id):
         super(Client, self).__init__(server=server, port=14243)
 
@@ -30,6 +76,19 @@ class Client(DCSS):
         self.ready = False
         self.client_id = None
         self.operation_no = 0
+        # default seconds to wait on dcss, None waits forever
+        self.timeout = None
+        # futures for operations we started, keyed by operation handle
+        self.operations = {}
+        # everything dcss has told us about the beamline
+        self.state = DeviceState()
+        for msg_type in self.state.appliers:
+            self.subscribe(msg_type + ' ', self.state.apply)
+        self.subscribe('stog_become_master', self._become_master)
+        self.subscribe('stog_other_master', self._become_slave)
+        self.subscribe('stog_become_slave', self._become_slave)
+        self.subscribe('stog_dcss_end_update_all_device', self._end_update)
+        self.subscribe('stog_operation_completed ', self._operation_completed)
 
         # some vars for dcss
         self.SID = session_id
@@ -54,45 +113,198 @@ class Client(DCSS):
 
         self.client_id = msg[1]
 
-    def _process_message(self, msg):
+    def _become_master(self, msg):
         if msg == 'stog_become_master':
             self.master = True
+
+    def _become_slave(self, msg):
         if msg == 'stog_other_master' or msg == 'stog_become_slave':
             self.master = False
+
+    def _end_update(self, msg):
         if msg == 'stog_dcss_end_update_all_device':
             self.ready = True
 
-    def become_master(self, force=True):
+    def _operation_completed(self, msg):
+        if self.operations:
+            parts = msg.split(None, 3)
+            future = self.operations.pop(parts[2], None)
+            if future is not None:
+                if self.metrics is not None:
+                    self.metrics.operation_completed(parts[2])
+                # the caller may have cancelled a wait=False future
+                if not future.done():
+                    future.set_result(msg)
+
+    def _connection_lost(self):
+        # dcss replays everything after we log in again
+        self.master = False
+        self.ready = False
+        self.state.clear()
+        operations, self.operations = self.operations, {}
+        for handle, future in operations.items():
+            if self.metrics is not None:
+                self.metrics.operation_abandoned(handle)
+            if not future.done():
+                future.set_exception(
+                    Disconnected('Connection lost during operation'))
+
+    def has_device(self, name):
+        state = self.state
+        return (name in state.strings or name in state.motors or
+                name in state.shutters)
+
+    def wait_for_devices(self, names, timeout=None):
+        """Read messages until every named device is known.
+
+        Names are strings, motors or shutters. Stops early once the whole
+        dump has been read, so a name dcss does not have can not block.
+        """
+        deadline = make_deadline(timeout)
+        while not self.ready and not all(map(self.has_device, names)):
+            self.read_message(remaining(deadline))
+
+    def get_string(self, string_name, default=None):
+        return self.state.strings.get(string_name, default)
+
+    def _read_reply(self, connection, deadline):
+        # read a message answering a request sent on connection, the answer
+        # never comes if we had to connect again meanwhile
+        msg = self.read_message(remaining(deadline))[0]
+        if self.connection_count != connection:
+            raise Disconnected('Connection lost waiting for dcss to answer')
+        return msg
+
+    def become_master(self, force=True, timeout=None):
         if self.master:
             return True
 
         force_str = 'force'
         if not force:
             force_str = 'noforce'
+        deadline = make_deadline(timeout)
+        self.ensure_connected(deadline)
+        connection = self.connection_count
         self.send_xos3('gtos_become_master %s' % force_str)
 
         # we will process messages for a while to check for sucess
-        for msg in self.process_messages():
+        while True:
+            msg = self._read_reply(connection, deadline)
             if msg == 'stog_become_master':
                 return True
             if msg == 'stog_other_master' or msg == 'stog_become_slave':
                 return False
 
     @master
-    def run_operation(self, name, *args):
-        args = ' '.join(map(str, args))
-        fmt = 'gtos_start_operation {name} {client_id}.{operation_no} {args}'
-        msg = fmt.format(name=name, client_id=self.client_id,
-                         operation_no=self.operation_no, args=args)
-        self.operation_no += 1
-        self.send_xos3(msg)
+    def run_operation(self, name, *args, wait=True, timeout=None):
+        """Start an operation and return its completion message.
+
+        With ``wait=False`` a future is returned straight away instead, it
+        resolves once the completion for this operation's handle has been
+        read, for example by ``wait_for_operations``. Raises Timeout if
+        becoming master or the completion takes longer than timeout.
+        """
+        handle, future = self._start_operation(name, args)
+        if not wait:
+            return future
 
         # wait for completion
-        msg = self.process_until('stog_operation_completed %s' % name)
-        return msg
+        return self.wait_for_operations([future], timeout)[0]
 
-    def set_string(self, string_name, data):
-        self.send_xos3('gtos_set_string %s %s' % (string_name, data))
+    def start_operation(self, name, *args):
+        """Start an operation without reading anything, return its future.
 
-        # wait for completion
-        self.process_until('stog_set_string_completed %s' % string_name)
+        For loops such as Hub that read the socket themselves. If we are not
+        master a forced become master is sent first. The future fails with
+        Disconnected straight away if we are not connected.
+        """
+        if self.socket is None:
+            future = Future()
+            future.set_exception(Disconnected('Not connected to dcss'))
+            return future
+        if not self.master:
+            self.send_xos3('gtos_become_master force')
+        return self._start_operation(name, args)[1]
+
+    def _start_operation(self, name, args):
+        handle = '{}.{}'.format(self.client_id, self.operation_no)
+        self.operation_no += 1
+        future = Future()
+        self.operations[handle] = future
+        if self.metrics is not None:
+            self.metrics.operation_started(name, handle)
+
+        args = ' '.join(map(str, args))
+        self.send_xos3('gtos_start_operation %s %s %s' % (name, handle, args))
+        return handle, future
+
+    @master
+    def stream_operation(self, name, *args, timeout=None, max_pending=64):
+        """Start an operation and yield its progress as it is read.
+
+        Yields ``parse_operation_update`` dicts for the updates to this
+        operation's handle, then the ``parse_operation_completed`` dict of
+        its completion. The operation starts on the first ``next``. Messages
+        are only read while the caller asks for more, updates read by other
+        calls in the meantime are kept up to ``max_pending``, dropping the
+        oldest. Raises Timeout if the whole operation takes longer than
+        timeout.
+        """
+        handle, future = self._start_operation(name, args)
+        updates = deque(maxlen=max_pending)
+
+        def collect(msg):
+            if msg.split(None, 3)[2] == handle:
+                updates.append(msg)
+
+        prefix = 'stog_operation_update %s ' % name
+        self.subscribe(prefix, collect)
+        self.keep_messages(prefix)
+        deadline = make_deadline(timeout)
+        try:
+            while True:
+                while updates:
+                    yield parse_operation_update(updates.popleft())
+                if future.done():
+                    break
+                self.read_message(remaining(deadline))
+        finally:
+            self.unsubscribe(prefix, collect)
+            self.release_messages(prefix)
+        yield parse_operation_completed(future.result())
+
+    def wait_for_operations(self, futures, timeout=None):
+        """Read messages until every future is done, return their results"""
+        futures = list(futures)
+        deadline = make_deadline(timeout)
+        for future in futures:
+            while not future.done():
+                self.read_message(remaining(deadline))
+        return [future.result() for future in futures]
+
+    def set_string(self, string_name, data, timeout=None):
+        return self.set_strings({string_name: data}, timeout)[string_name]
+
+    def set_strings(self, strings, timeout=None):
+        """Set many strings in about one round trip.
+
+        Sends a gtos_set_string for each name in the strings dict back to
+        back, then reads until every one has completed. Returns
+        {name: stog_set_string_completed message}. Raises Disconnected if
+        the connection drops before then.
+        """
+        deadline = make_deadline(timeout)
+        self.ensure_connected(deadline)
+        connection = self.connection_count
+        for string_name, data in strings.items():
+            self.send_xos3('gtos_set_string %s %s' % (string_name, data))
+
+        # completions can arrive in any order
+        results = {}
+        while len(results) < len(strings):
+            msg = self._read_reply(connection, deadline)
+            if msg.startswith('stog_set_string_completed '):
+                string_name = msg.split(None, 2)[1]
+                if string_name in strings:
+                    results[string_name] = msg
+        return results
@@ -1,6 +1,12 @@
 import socket
 import logging
+import random
+import threading
 import time
+from collections import Counter, deque
+
+from .framing import FrameDecoder, encode_xos1, encode_xos3
+from .record import RECEIVED, SENT
 
 
 # small wrapper to make sure we are connected
@@ -12,6 +18,66 @@ def connected(func):
     return wrapper
 
 
+class DCSSError(Exception):
+    pass
+
+
+class Disconnected(DCSSError):
+    """The connection to dcss was lost or could not be made"""
+
+
+class Timeout(DCSSError):
+    """No answer from dcss before the deadline"""
+
+
+def make_deadline(timeout):
+    if timeout is None:
+        return None
+    return time.monotonic() + timeout
+
+
+def remaining(deadline):
+    """Seconds left until deadline, raises Timeout once it has passed"""
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise Timeout('Timed out waiting for dcss')
+    return left
+
+
+class ReconnectPolicy(object):
+    """Exponential backoff with jitter between connection attempts.
+
+    The first attempt is made straight away, after that the delay starts at
+    ``initial`` seconds and grows by ``factor`` up to ``maximum``. Each delay
+    is shortened by a random fraction of up to ``jitter`` so many clients do
+    not reconnect in lock step. ``max_attempts`` of None retries forever.
+    """
+
+    def __init__(self, initial=0.05, maximum=5.0, factor=2.0, jitter=0.5,
+                 max_attempts=None):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.max_attempts = max_attempts
+
+    def delays(self):
+        """Seconds to wait before each attempt"""
+        yield 0
+        attempt = 1
+        delay = self.initial
+        while self.max_attempts is None or attempt < self.max_attempts:
+            yield delay * (1 - self.jitter * random.random())
+            delay = min(delay * self.factor, self.maximum)
+            attempt += 1
+
+
+def _as_bytes(prefix):
+    return prefix.encode('utf-8') if isinstance(prefix, str) else prefix
+
+
 def debug(func):
     def wrapper(self, *args, **kwargs):
         self.debug = True
@@ -20,77 +86,179 @@ def debug(func):
 
 
 class DCSS(object):
-    def __init__(self, server=None, port=None, SID=None):
+    # number of leading XOS1 frames sent by dcss on each connection
+    xos1_frames = 0
+    # byte prefixes of the messages the class itself needs, these are kept
+    # whatever filter_messages is given
+    internal_prefixes = ()
+
+    def __init__(self, server=None, port=None, SID=None, read_size=65536,
+                 reconnect_policy=None):
         self.debug = False
 
         self.socket = None
+        # operation handlers send from worker threads
+        self.send_lock = threading.Lock()
         self.server = server
         self.port = port
 
-        # socket recv buffer
-        self.buffer = b''
+        # socket recv buffer and the frames decoded but not yet read
+        self.read_size = read_size
+        self.decoder = FrameDecoder(self.xos1_frames, read_size)
+        self.frames = deque()
 
         self.log = logging.getLogger('DCSS')
 
         # Instance variable for dcss login status
         self.dcss_client_loggedin = False
 
-    def connect(self):
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # optional dcss.record.Recorder saving every frame sent and received
+        self.recorder = None
+        # optional dcss.metrics.Metrics counting messages, bytes and latency
+        self.metrics = None
 
-        while True:
-            try:
-                self.log.info("Connecting to %s:%s" % (self.server, self.port))
-                self.socket.connect((self.server, self.port))
-            except socket.error:
-                # Failure
-                self.log.error('Failed to connect to %s:%s',
-                               self.server, self.port)
-                # Reduce frequency of connect attempts when having trouble
-                # connecting
-                time.sleep(5)
-            else:
-                # Success
-                self.log.info("Connected to %s:%s" % (self.server, self.port))
-                # we have 1 second to login after 'stoc_send_client_type'
-                self.login()
-                break
+        # byte prefixes of the messages to process, None processes them all
+        self.message_filter = None
+        # prefixes given to filter_messages, None for no filter, and the
+        # prefixes temporarily kept by keep_messages with how many asked
+        self.filter_prefixes = None
+        self.kept_prefixes = Counter()
+
+        # (prefix, callback) pairs in the order they were subscribed, and
+        # the pairs that can match each message type seen since
+        self.subscriptions = []
+        self.routes = {}
+
+        # reads reconnect and log in again when the connection drops
+        self.auto_reconnect = True
+        self.connecting = False
+        # counts the connections made, a change tells a caller waiting on
+        # an answer that it was asked on a connection since lost
+        self.connection_count = 0
+        if reconnect_policy is None:
+            reconnect_policy = ReconnectPolicy()
+        self.reconnect_policy = reconnect_policy
+
+    @property
+    def is_connected(self):
+        return self.socket is not None
+
+    def connect(self, deadline=None):
+        """Connect and log in, retrying on the reconnect policy.
+
+        Raises Timeout if that has not worked by deadline, see make_deadline.
+        """
+        for delay in self.reconnect_policy.delays():
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise Timeout('Timed out connecting to %s:%s' %
+                              (self.server, self.port))
+            # Reduce frequency of connect attempts when having trouble
+            # connecting
+            time.sleep(delay)
+            if self.try_connect(deadline):
+                return
+        raise Disconnected('Unable to connect to %s:%s' %
+                           (self.server, self.port))
+
+    def ensure_connected(self, deadline=None):
+        """Connect first if needed, for calls that send and then read.
+
+        Sending never connects, operation handlers and timers send from
+        other threads than the one reading.
+        """
+        if self.socket is None:
+            self.connect(deadline)
+
+    def try_connect(self, deadline=None):
+        """Make one attempt to connect and log in, return True on success"""
+        # the deadline bounds connecting and each read while logging in
+        timeout = remaining(deadline)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            self.log.info("Connecting to %s:%s" % (self.server, self.port))
+            sock.connect((self.server, self.port))
+        except socket.timeout:
+            sock.close()
+            raise Timeout('Timed out connecting to %s:%s' %
+                          (self.server, self.port))
+        except socket.error:
+            # Failure
+            sock.close()
+            self.log.error('Failed to connect to %s:%s',
+                           self.server, self.port)
+            return False
+        # Success
+        self.log.info("Connected to %s:%s" % (self.server, self.port))
+        self.socket = sock
+        self.connection_count += 1
+        self.decoder = FrameDecoder(self.xos1_frames, self.read_size)
+        self.frames.clear()
+        # we have 1 second to login after 'stoc_send_client_type'
+        self.connecting = True
+        try:
+            self.login()
+        except Disconnected:
+            return False
+        except Timeout:
+            self.close()
+            raise
+        finally:
+            self.connecting = False
+        if self.socket is not None:
+            self.socket.settimeout(None)
+        return True
+
+    def _disconnected(self, reason):
+        # drop the connection and everything that belonged to it
+        self.log.info('%s dcss server at %s:%s', reason, self.server, self.port)
+        if self.socket is not None:
+            self.socket.close()
+        self.socket = None
+        self.dcss_client_loggedin = False
+        self._connection_lost()
+        raise Disconnected('%s dcss server at %s:%s' %
+                           (reason, self.server, self.port))
+
+    def _connection_lost(self):
+        pass
 
     @connected
-    def readfully(self, bytes_to_read):
-        bytes_to_read = int(bytes_to_read)
-        if bytes_to_read == 0:
-            return ''
-        while len(self.buffer) < bytes_to_read:
-            try:
-                bytes_read = self.socket.recv(1024)
-            except socket.error:
-                self.log.info('EXDisconnected by dcss server at %s:%s',
-                              self.server, self.port)
-                return ''
-            # If zero bytes read connection has been closed by dcss server
-            if len(bytes_read) == 0:
-                self.log.info('Disconnected by dcss server at %s:%s',
-                              self.server, self.port)
-                # Close the socket
-                self.socket = None
-                # Limit frequency of connection attempts
-                time.sleep(5)
-                return ''
-            self.buffer += bytes_read
-
-        data = self.buffer[:bytes_to_read].decode('utf-8')
-        self.buffer = self.buffer[bytes_to_read:]
-        return data
+    def receive(self, timeout=None):
+        """Read whatever is available from the socket into the frame queue"""
+        if timeout is not None:
+            self.socket.settimeout(timeout)
+        try:
+            bytes_read = self.socket.recv_into(self.decoder.get_buffer())
+        except socket.timeout:
+            # a partly received frame stays in the decoder
+            raise Timeout('Timed out waiting for dcss')
+        except socket.error:
+            self._disconnected('Lost connection to')
+        finally:
+            if timeout is not None and self.socket is not None:
+                self.socket.settimeout(None)
+        # If zero bytes read connection has been closed by dcss server
+        if bytes_read == 0:
+            self._disconnected('Disconnected by')
+        if self.metrics is not None:
+            self.metrics.transferred('in', bytes_read)
+        frames = self.decoder.buffer_updated(bytes_read)
+        if self.recorder is not None:
+            # as they arrive, frames may yet be dropped unread
+            self.recorder.record_frames(RECEIVED, frames)
+        self.frames.extend(frames)
 
     def send_xos1(self, msg):
-        msg = msg.encode('utf-8')
-        if len(msg) >= 200:
-            raise Exception("Message to long")
+        packet = encode_xos1(msg)
         self.log.debug('sending xos1: %r', msg)
-        msg = b"%s\0" % msg
+        if self.recorder is not None:
+            self.recorder.record(SENT, msg.encode('utf-8'))
+        if self.metrics is not None:
+            self.metrics.message('out', msg, len(packet))
         try:
-            self.socket.sendall(msg.rjust(200))
+            with self.send_lock:
+                self.socket.sendall(packet)
         except socket.error:
             # Just log the error
             self.log.info('Error sending msg to dcss server at %s:%s',
@@ -101,11 +269,14 @@ class DCSS(object):
 
     def send_xos3(self, msg, data=b''):
         self.log.debug('sending xos3: %r', msg)
-        msg = msg.encode('utf-8')
-        header = b"%12d %12d " % (len(msg), len(data))
-        packet = b"%s%s%s" % (header, msg, data)
+        packet = encode_xos3(msg, data)
+        if self.recorder is not None:
+            self.recorder.record(SENT, msg.encode('utf-8'), data)
+        if self.metrics is not None:
+            self.metrics.message('out', msg, len(packet))
         try:
-            self.socket.sendall(packet)
+            with self.send_lock:
+                self.socket.sendall(packet)
         except socket.error:
             # Just log the error
             self.log.info('Error sending msg to dcss server at %s:%s',
@@ -114,44 +285,144 @@ class DCSS(object):
             self.log.info('Cannot send, not yet connected to dcss server at %s:%s',
                           self.server, self.port)
 
-    def read_header(self):
-        header = self.readfully(26)
-        if header == '':
-            # Read fail
-            return 0, 0
+    def filter_messages(self, *prefixes):
+        """Only decode and process messages starting with one of prefixes.
+
+        Other frames are dropped as raw bytes, before they are decoded,
+        logged or processed, and reads wait for the next wanted message.
+        ``internal_prefixes`` are always kept. Without prefixes every message
+        is processed again.
+        """
+        if prefixes:
+            self.filter_prefixes = tuple(map(_as_bytes, prefixes))
+        else:
+            self.filter_prefixes = None
+        self._update_filter()
+
+    def keep_messages(self, prefix):
+        """Let messages starting with prefix through any filter.
+
+        Calls are counted, the prefix is filtered again once
+        release_messages has been called as often.
+        """
+        self.kept_prefixes[_as_bytes(prefix)] += 1
+        self._update_filter()
+
+    def release_messages(self, prefix):
+        prefix = _as_bytes(prefix)
+        self.kept_prefixes[prefix] -= 1
+        if self.kept_prefixes[prefix] <= 0:
+            del self.kept_prefixes[prefix]
+        self._update_filter()
+
+    def _update_filter(self):
+        if self.filter_prefixes is None:
+            self.message_filter = None
         else:
-            # Read success
-            return int(header[0:13]), int(header[14:26])
+            self.message_filter = (self.filter_prefixes +
+                                   self.internal_prefixes +
+                                   tuple(self.kept_prefixes))
+
+    def _pop_frame(self):
+        # the next queued frame, or None if it is filtered out
+        frame = self.frames.popleft()
+        if (self.message_filter is not None and
+                not frame[0].startswith(self.message_filter)):
+            return None
+        return frame
+
+    def read_frame(self, timeout=None):
+        deadline = make_deadline(timeout)
+        while True:
+            while not self.frames:
+                if self.socket is None:
+                    # logging in may queue frames already
+                    self.connect(deadline)
+                    continue
+                try:
+                    self.receive(remaining(deadline))
+                except Disconnected:
+                    if not self.auto_reconnect or self.connecting:
+                        raise
+            frame = self._pop_frame()
+            if frame is not None:
+                return frame
 
-    def read_message(self):
-        msg_len, data_len = self.read_header()
-        msg = self.readfully(msg_len).rstrip('\0')
-        data = self.readfully(data_len)
+    def read_message(self, timeout=None):
+        return self.process_frame(*self.read_frame(timeout))
+
+    def process_frame(self, msg, data):
+        """Decode and process a received frame, as read_message does"""
+        # dcss NUL terminates XOS3 messages
+        msg = msg.rstrip(b'\0').decode('utf-8')
+        data = data.decode('utf-8')
         # Log mesg if recv good
         if msg != '':
             self.log.debug('received: %r', msg)
+        if self.metrics is not None:
+            self.metrics.message('in', msg)
         # process every message internally
         self._process_message(msg)
         # dont actually need data (only used for auth)
         return msg, data
 
-    @connected
+    def process_pending(self):
+        """Process frames already received without reading the socket"""
+        messages = []
+        while self.frames:
+            frame = self._pop_frame()
+            if frame is not None:
+                messages.append(self.process_frame(*frame)[0])
+        return messages
+
     def read_message_xos1(self):
-        message = self.readfully(200).rstrip('\0')
-        self.log.debug('received xos1: %r', message)
-        # process every message internally
-        self._process_message(message)
-        return message
+        # framing is handled by the decoder, see xos1_frames
+        return self.read_message()[0]
 
     def login(self):
         raise Exception('Must overide')
 
     def close(self):
         self.dcss_client_loggedin = False
-        self.socket.close()
+        if self.socket is not None:
+            self.socket.close()
+        self.socket = None
+
+    def subscribe(self, prefix, callback):
+        """Call callback(msg) for every message starting with prefix.
+
+        Subscribers are looked up by message type, so messages nobody
+        subscribed to cost one dict lookup however many subscriptions there
+        are. Callbacks run in the order they were subscribed.
+        """
+        self.subscriptions.append((prefix, callback))
+        self.routes.clear()
+        return callback
+
+    def unsubscribe(self, prefix, callback):
+        self.subscriptions.remove((prefix, callback))
+        self.routes.clear()
+
+    def _route(self, msg_type):
+        # a prefix with a space names the whole message type, one without
+        # may be the start of many types
+        routes = []
+        for prefix, callback in self.subscriptions:
+            prefix_type, space, _ = prefix.partition(' ')
+            if prefix_type == msg_type or (not space and
+                                           msg_type.startswith(prefix)):
+                routes.append((prefix, callback))
+        routes = self.routes[msg_type] = tuple(routes)
+        return routes
 
     def _process_message(self, msg):
-        pass
+        msg_type = msg.partition(' ')[0]
+        routes = self.routes.get(msg_type)
+        if routes is None:
+            routes = self._route(msg_type)
+        for prefix, callback in routes:
+            if msg.startswith(prefix):
+                callback(msg)
 
     def process_messages(self):
         while True:
@@ -168,7 +439,9 @@ class DCSS(object):
             self.close()
             self.log.info("Done.")
 
-    def process_until(self, msg_to_stop_on):
-        for msg in self.process_messages():
+    def process_until(self, msg_to_stop_on, timeout=None):
+        deadline = make_deadline(timeout)
+        while True:
+            msg = self.read_message(remaining(deadline))[0]
             if msg.startswith(msg_to_stop_on):
                 return msg
@@ -0,0 +1,113 @@
+# XOS message framing, independent of any socket handling.
+#
+# XOS1 messages are a fixed 200 byte NUL padded block.
+# XOS3 messages are a 26 byte header holding the message and data lengths
+# as two 12 digit fields followed by a space each, then the message and the
+# binary data.
+
+XOS1_LENGTH = 200
+XOS3_HEADER_LENGTH = 26
+
+
+def encode_xos1(msg):
+    msg = msg.encode('utf-8')
+    if len(msg) >= XOS1_LENGTH:
+        raise Exception("Message to long")
+    return (b"%s\0" % msg).rjust(XOS1_LENGTH)
+
+
+def encode_xos3(msg, data=b''):
+    msg = msg.encode('utf-8')
+    header = b"%12d %12d " % (len(msg), len(data))
+    return b"%s%s%s" % (header, msg, data)
+
+
+class FrameDecoder(object):
+    """Incremental decoder for XOS1 and XOS3 framed messages.
+
+    Bytes can either be passed to ``feed`` or written in place into the
+    buffer returned by ``get_buffer`` and committed with ``buffer_updated``.
+    Both return a list of every ``(message, data)`` frame completed so far.
+    The first ``xos1_frames`` frames are read with XOS1 framing, everything
+    after that with XOS3 framing. XOS1 messages have their NUL padding
+    stripped, XOS3 messages are returned exactly as sent.
+    """
+
+    def __init__(self, xos1_frames=0, read_size=65536):
+        self.xos1_frames = xos1_frames
+        self.read_size = read_size
+
+        # unread bytes live in buffer[start:end]
+        self.buffer = bytearray(2 * read_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def _reserve(self, nbytes):
+        # make room for nbytes after end. Unread bytes are moved to the
+        # front of the buffer and it is only grown if that is not enough
+        if self.end + nbytes <= len(self.buffer):
+            return
+        unread = self.end - self.start
+        if unread + nbytes > len(self.buffer):
+            size = max(2 * len(self.buffer), unread + nbytes)
+            self.view.release()
+            self.buffer.extend(bytes(size - len(self.buffer)))
+            self.view = memoryview(self.buffer)
+        self.view[:unread] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = unread
+
+    def get_buffer(self, sizehint=-1):
+        nbytes = max(sizehint, self.read_size)
+        self._reserve(nbytes)
+        return self.view[self.end:self.end + nbytes]
+
+    def buffer_updated(self, nbytes):
+        self.end += nbytes
+        return self.frames()
+
+    def feed(self, data):
+        nbytes = len(data)
+        self._reserve(nbytes)
+        self.view[self.end:self.end + nbytes] = data
+        return self.buffer_updated(nbytes)
+
+    def _next_frame(self):
+        buffer, view = self.buffer, self.view
+        start, available = self.start, self.end - self.start
+        if self.xos1_frames > 0:
+            if available < XOS1_LENGTH:
+                return None
+            self.xos1_frames -= 1
+            self.start = start + XOS1_LENGTH
+            return view[start:self.start].tobytes().rstrip(b'\0'), b''
+
+        if available < XOS3_HEADER_LENGTH:
+            return None
+        msg_len = int(buffer[start:start + 13])
+        data_len = int(buffer[start + 14:start + 26])
+        msg_start = start + XOS3_HEADER_LENGTH
+        data_start = msg_start + msg_len
+        frame_end = data_start + data_len
+        if frame_end > self.end:
+            return None
+        self.start = frame_end
+        # any NUL terminator is left on, so uninteresting messages can be
+        # dropped without touching them
+        return (view[msg_start:data_start].tobytes(),
+                view[data_start:frame_end].tobytes())
+
+    def frames(self):
+        frames = []
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                break
+            frames.append(frame)
+        if self.start == self.end:
+            self.start = self.end = 0
+        return frames
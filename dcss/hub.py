@@ -0,0 +1,149 @@
+# one thread servicing many dcss connections
+import logging
+import selectors
+import time
+
+from .dcss import Disconnected, Timeout, make_deadline
+
+
+class Hub(object):
+    """Services many Client (or Runs) connections from one selector loop.
+
+    Connections are added under a key, usually the beamline name. Every
+    message read is passed to the ``on_message`` callbacks as
+    ``(key, connection, msg)``. Dropped connections are retried on their
+    own reconnect policy. Each connection attempt, including logging in,
+    holds up the others for at most ``connect_timeout`` seconds.
+    """
+
+    def __init__(self, connect_timeout=2.0):
+        self.connect_timeout = connect_timeout
+        self.selector = selectors.DefaultSelector()
+        self.connections = {}
+        self.callbacks = []
+        # key -> (delays iterator, time of next connection attempt)
+        self.retrying = {}
+        self.log = logging.getLogger('DCSS')
+
+    def __getitem__(self, key):
+        return self.connections[key]
+
+    def __iter__(self):
+        return iter(self.connections)
+
+    def __len__(self):
+        return len(self.connections)
+
+    def add(self, key, connection):
+        """Connect if needed and start servicing connection under key"""
+        if key in self.connections:
+            raise KeyError('%s is already in the hub' % key)
+        self.connections[key] = connection
+        if connection.socket is not None:
+            self._register(key, connection)
+        elif self._try_connect(connection):
+            self._register(key, connection)
+        else:
+            # an unreachable beamline is retried like a dropped one
+            delays = connection.reconnect_policy.delays()
+            next(delays)
+            self._schedule(key, delays)
+        return connection
+
+    def _try_connect(self, connection):
+        try:
+            return connection.try_connect(make_deadline(self.connect_timeout))
+        except Timeout:
+            return False
+
+    def remove(self, key):
+        connection = self.connections.pop(key)
+        self.retrying.pop(key, None)
+        if connection.socket is not None:
+            self.selector.unregister(connection.socket)
+        return connection
+
+    def close(self):
+        for key in list(self.connections):
+            self.remove(key).close()
+        self.selector.close()
+
+    def on_message(self, callback):
+        self.callbacks.append(callback)
+        return callback
+
+    def _register(self, key, connection):
+        self.selector.register(connection.socket, selectors.EVENT_READ, key)
+        # login can leave messages queued that select will not report
+        self._dispatch(key, connection)
+
+    def _dispatch(self, key, connection):
+        for msg in connection.process_pending():
+            for callback in self.callbacks:
+                callback(key, connection, msg)
+
+    def _lost(self, key, connection, sock):
+        self.selector.unregister(sock)
+        delays = connection.reconnect_policy.delays()
+        self._schedule(key, delays)
+
+    def _schedule(self, key, delays):
+        try:
+            delay = next(delays)
+        except StopIteration:
+            self.log.error('Giving up reconnecting to %s', key)
+            self.retrying.pop(key, None)
+            return
+        self.retrying[key] = (delays, time.time() + delay)
+
+    def _retry(self):
+        now = time.time()
+        for key, (delays, due) in list(self.retrying.items()):
+            if due > now:
+                continue
+            connection = self.connections[key]
+            if self._try_connect(connection):
+                del self.retrying[key]
+                self._register(key, connection)
+            else:
+                self._schedule(key, delays)
+
+    def poll(self, timeout=None):
+        """Service every readable connection once, waiting up to timeout"""
+        if self.retrying:
+            next_due = min(due for _, due in self.retrying.values())
+            wait = max(0, next_due - time.time())
+            timeout = wait if timeout is None else min(timeout, wait)
+        for selector_key, _ in self.selector.select(timeout):
+            key = selector_key.data
+            connection = self.connections[key]
+            try:
+                connection.receive()
+            except Disconnected:
+                self._lost(key, connection, selector_key.fileobj)
+            self._dispatch(key, connection)
+        if self.retrying:
+            self._retry()
+
+    def run_forever(self):
+        while True:
+            self.poll()
+
+    def wait_for(self, futures):
+        """Poll until every future is done, return their results"""
+        futures = list(futures)
+        while not all(future.done() for future in futures):
+            self.poll()
+        return [future.result() for future in futures]
+
+    def run_operation(self, name, *args):
+        """Start an operation on every connection, return {key: future}.
+
+        Nothing is read here, the futures resolve as poll reads completions.
+        """
+        return {key: connection.start_operation(name, *args)
+                for key, connection in self.connections.items()}
+
+    def get_string(self, string_name):
+        return {key: connection.get_string(string_name)
+                for key, connection in self.connections.items()}
@@ -0,0 +1,122 @@
+# Optional instrumentation, set an instance as DCSS.metrics to enable it.
+import bisect
+import threading
+import time
+from collections import Counter
+
+# upper bounds in seconds of the operation latency buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+
+class Histogram(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # the last count is for values above every bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, count of values up to it) pairs, ending with inf"""
+        total = 0
+        bounds = self.buckets + (float('inf'), )
+        pairs = []
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+class Metrics(object):
+    """Counts messages and bytes per direction and times operations.
+
+    Messages are counted by type and direction ('in' or 'out'). Operation
+    latency, from start to completion, goes into a histogram per name.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.messages = Counter()
+        self.bytes = Counter()
+        self.latency = {}
+        # operation handle -> (name, start time) for operations in flight
+        self.started = {}
+
+    def message(self, direction, msg, nbytes=0):
+        msg_type = msg.partition(' ')[0]
+        with self.lock:
+            self.messages[direction, msg_type] += 1
+            self.bytes[direction] += nbytes
+
+    def transferred(self, direction, nbytes):
+        with self.lock:
+            self.bytes[direction] += nbytes
+
+    def operation_started(self, name, handle):
+        self.started[handle] = (name, time.monotonic())
+
+    def operation_completed(self, handle):
+        started = self.started.pop(handle, None)
+        if started is not None:
+            name, start = started
+            self.observe(name, time.monotonic() - start)
+
+    def operation_abandoned(self, handle):
+        # the connection was lost, the completion will never come
+        self.started.pop(handle, None)
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.latency.get(name)
+            if histogram is None:
+                histogram = self.latency[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        with self.lock:
+            messages = {}
+            for (direction, msg_type), count in self.messages.items():
+                messages.setdefault(direction, {})[msg_type] = count
+            latency = {}
+            for name, histogram in self.latency.items():
+                latency[name] = {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'buckets': histogram.cumulative(),
+                }
+            return {
+                'messages': messages,
+                'bytes': dict(self.bytes),
+                'operations_in_flight': len(self.started),
+                'operation_latency': latency,
+            }
+
+    def prometheus(self, prefix='dcss'):
+        """The metrics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = ['# TYPE %s_messages_total counter' % prefix]
+        for direction, counts in sorted(snapshot['messages'].items()):
+            for msg_type, count in sorted(counts.items()):
+                lines.append('%s_messages_total{direction="%s",type="%s"} %d'
+                             % (prefix, direction, msg_type, count))
+        lines.append('# TYPE %s_bytes_total counter' % prefix)
+        for direction, count in sorted(snapshot['bytes'].items()):
+            lines.append('%s_bytes_total{direction="%s"} %d'
+                         % (prefix, direction, count))
+        lines.append('# TYPE %s_operation_seconds histogram' % prefix)
+        for name, histogram in sorted(snapshot['operation_latency'].items()):
+            for bound, count in histogram['buckets']:
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append('%s_operation_seconds_bucket{operation="%s",le="%s"}'
+                             ' %d' % (prefix, name, le, count))
+            lines.append('%s_operation_seconds_sum{operation="%s"} %r'
+                         % (prefix, name, histogram['sum']))
+            lines.append('%s_operation_seconds_count{operation="%s"} %d'
+                         % (prefix, name, histogram['count']))
+        return '\n'.join(lines) + '\n'
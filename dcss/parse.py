@@ -1,4 +1,45 @@
 import re
+from array import array
+
+
+START_OPERATION_RE = re.compile(
+    r'^(?P<direction>.*)_start_operation (?P<name>\S+) +'
+    r'(?P<handle>\S+)( +(?P<arguments>.*))? *$')
+OPERATION_UPDATE_RE = re.compile(
+    r'^(?P<direction>.*)_operation_update (?P<name>\S+) +'
+    r'(?P<handle>\S+)( +(?P<arguments>.*))? *$')
+OPERATION_COMPLETED_RE = re.compile(
+    r'^(?P<direction>.*)_operation_completed (?P<name>\S+) +'
+    r'(?P<handle>\S+) +(?P<status>\S+)( +(?P<arguments>.*))? *$')
+HOLDER_FOUND_RE = re.compile(
+    r'robot_config +(?P<handle>\S+) +'
+    r'found +(?P<type>.+) +(?P<position>.) +'
+    r'dz: +(?P<dz>\S+) *$')
+ROBOT_FORCE_RE = re.compile(
+    r'robot_force_(?P<position>\S+) +(?P<status>\S+?) +'
+    r'(?P<height>\S+)(?P<forces>( +\S+)+) *$')
+ROBOT_CASSETTE_RE = re.compile(
+    r'robot_cassette +(?P<status>.+?)(?P<holder_data>( +\S){291})')
+
+POSITION_LOOKUP = {'l': 'left', 'm': 'middle', 'r': 'right'}
+HOLDER_LOOKUP = {
+    'calibration cassette': 'calibration cassette',
+    'normal cassette': 'cassette',
+    'super puck adaptor': 'puck adaptor',
+}
+# compact forces use NaN for empty ('EEEE') and unknown ('uuuu') ports
+FORCE_PLACEHOLDERS = ('EEEE', 'uuuu')
+NAN = float('nan')
+# maps ascii digits to their values, for compact probe ports
+DIGITS = bytes.maketrans(b'0123456789', bytes(range(10)))
+
+HOLDER_TYPE_LOOKUP = {
+    '1': 'cassette',
+    '2': 'calibration cassette',
+    '3': 'puck adaptor',
+    'X': 'bad',
+    'u': 'unknown',
+}
 
 
 def parse_start_operation(message):
@@ -12,9 +53,7 @@ def parse_start_operation(message):
       * arguments: operation arguments (str or None)
     """
 
-    regex = r'^(?P<direction>.*)_start_operation (?P<name>\S+) +'\
-            r'(?P<handle>\S+)( +(?P<arguments>.*))? *$'
-    return re.search(regex, message).groupdict()
+    return START_OPERATION_RE.search(message).groupdict()
 
 
 def parse_operation_update(message):
@@ -28,9 +67,7 @@ def parse_operation_update(message):
       * arguments: operation update arguments (str or None)
     """
 
-    regex = r'^(?P<direction>.*)_operation_update (?P<name>\S+) +'\
-            r'(?P<handle>\S+)( +(?P<arguments>.*))? *$'
-    return re.search(regex, message).groupdict()
+    return OPERATION_UPDATE_RE.search(message).groupdict()
 
 
 def parse_operation_completed(message):
@@ -44,9 +81,7 @@ def parse_operation_completed(message):
       * arguments: operation update arguments (str or None)
     """
 
-    regex = r'^(?P<direction>.*)_operation_completed (?P<name>\S+) +'\
-            r'(?P<handle>\S+) +(?P<status>\S+)( +(?P<arguments>.*))? *$'
-    return re.search(regex, message).groupdict()
+    return OPERATION_COMPLETED_RE.search(message).groupdict()
 
 
 def parse_holder_found_message(message):
@@ -60,28 +95,19 @@ def parse_holder_found_message(message):
       * dz: height difference (float)
     """
 
-    regex = r'robot_config +(?P<handle>\S+) +'\
-            r'found +(?P<type>.+) +(?P<position>.) +'\
-            r'dz: +(?P<dz>\S+) *$'
-    data = re.search(regex, message).groupdict()
+    data = HOLDER_FOUND_RE.search(message).groupdict()
     # TODO: Handle regex fail - log message and raise exception
     # TODO: Add warning if position or type unknown
-    position_lookup = {'l': 'left', 'm': 'middle', 'r': 'right'}
-    holder_lookup = {
-        'calibration cassette': 'calibration cassette',
-        'normal cassette': 'cassette',
-        'super puck adaptor': 'puck adaptor',
-    }
     parsed = {
         'handle': data['handle'],
-        'position': position_lookup.get(data['position'], 'unknown'),
-        'type': holder_lookup.get(data['type'], 'unknown'),
+        'position': POSITION_LOOKUP.get(data['position'], 'unknown'),
+        'type': HOLDER_LOOKUP.get(data['type'], 'unknown'),
         'dz': float(data['dz']),
     }
     return parsed
 
 
-def parse_robot_force_message(message):
+def parse_robot_force_message(message, compact=False):
 
     """
     Parses "stog_set_string_completed robot_force_..." messages.
@@ -92,12 +118,23 @@ def parse_robot_force_message(message):
       * forces: list of dictionaries with keys:
         * force: force measurement (float or None)
         * empty: if port is empty (bool)
+    With compact=True forces is an array('d') with NaN for empty and
+    unknown ports.
     """
 
-    regex = r'robot_force_(?P<position>\S+) +(?P<status>\S+?) +'\
-            r'(?P<height>\S+)(?P<forces>( +\S+)+) *$'
-    data = re.search(regex, message).groupdict()
+    data = ROBOT_FORCE_RE.search(message).groupdict()
     # TODO: Handle regex fail - log message and raise exception
+    if compact:
+        forces = array('d', [NAN if force_str in FORCE_PLACEHOLDERS
+                             else float(force_str)
+                             for force_str in data['forces'].split()])
+        return {
+            'position': data['position'],
+            'status': data['status'],
+            'height': float(data['height']),
+            'forces': forces,
+        }
+
     forces = []
     for force_str in data['forces'].split():
         if force_str == 'EEEE':
@@ -122,7 +159,7 @@ def parse_robot_force_message(message):
     return parsed
 
 
-def parse_robot_cassette_message(message):
+def parse_robot_cassette_message(message, compact=False):
 
     """
     Parses "stog_set_string_completed robot_cassette ..." messages.
@@ -131,25 +168,26 @@ def parse_robot_cassette_message(message):
       * holders: list of dictionaries containing:
         * type: 'calibration cassette', 'cassette', 'puck adaptor', 'bad', 'unknown'
         * ports: 96 element list of '0', '1', 'j', 'u', '-', 'b'
+    With compact=True ports is 96 bytes, one per port, e.g. b'11j-...'.
     """
 
-    regex = r'robot_cassette +(?P<status>.+?)(?P<holder_data>( +\S){291})'
-    data = re.search(regex, message).groupdict()
-    holder_data = data['holder_data'].split()
+    data = ROBOT_CASSETTE_RE.search(message).groupdict()
     holders = []
+    elems_per_holder = 97  # 96 ports plus 1 for holder type
 
-    type_lookup = {
-        '1': 'cassette',
-        '2': 'calibration cassette',
-        '3': 'puck adaptor',
-        'X': 'bad',
-        'u': 'unknown',
-    }
+    if compact:
+        holder_data = data['holder_data'].replace(' ', '').encode('ascii')
+        for i in range(0, len(holder_data), elems_per_holder):
+            holders.append({
+                'type': HOLDER_TYPE_LOOKUP.get(chr(holder_data[i])),
+                'ports': holder_data[i+1:i+elems_per_holder],
+            })
+        return {'status': data['status'], 'holders': holders}
 
-    elems_per_holder = 97  # 96 ports plus 1 for holder type
+    holder_data = data['holder_data'].split()
     for i in range(0, len(holder_data), elems_per_holder):
         # TODO: Add warning of no match
-        holder_type = type_lookup.get(holder_data[i])
+        holder_type = HOLDER_TYPE_LOOKUP.get(holder_data[i])
         holders.append({
             'type': holder_type,
             'ports': holder_data[i+1:i+elems_per_holder],
@@ -163,7 +201,7 @@ def parse_robot_cassette_message(message):
     return parsed
 
 
-def parse_start_robot_probe_message(message):
+def parse_start_robot_probe_message(message, compact=False):
 
     """
     Parses "_start_operation robot_config probe" type messages.
@@ -175,11 +213,22 @@ def parse_start_robot_probe_message(message):
       * holders: list of dictionaries containing
         * probe_holder_type: 0 or 1
         * ports: 96 element list of 0 or 1
+    With compact=True ports is an array('b').
     """
 
     parsed = parse_start_operation(message)
     parsed['holders'] = []
-    values = list(map(int, parsed['arguments'].replace('probe ', '').split()))
+    values = parsed['arguments'].replace('probe ', '').split()
+    if len(values) != 3 * 97:
+        raise ValueError('Expected 291 probe values, got %d' % len(values))
+    if compact:
+        digits = ''.join(values).encode('ascii', 'replace')
+        # one digit per value, anything else would translate wrongly
+        if len(digits) != len(values) or digits.translate(None, b'0123456789'):
+            raise ValueError('Probe values must be single digits')
+        values = array('b', digits.translate(DIGITS))
+    else:
+        values = list(map(int, values))
     for holder_idx in range(3):
         offset = holder_idx * 97
         parsed['holders'].append({
@@ -187,3 +236,134 @@ def parse_start_robot_probe_message(message):
             'ports': values[offset+1:offset+97],
         })
     return parsed
+
+
+def diff_ports(old, new):
+
+    """
+    Compares two compact port or force snapshots of the same length, as
+    returned with compact=True. Returns the list of indices that changed,
+    NaN forces compare equal to each other.
+    """
+
+    if len(old) != len(new):
+        raise ValueError('Snapshots differ in length')
+    # compare the raw buffers first, the common case is no change at all
+    if memoryview(old).cast('B') == memoryview(new).cast('B'):
+        return []
+    return [i for i, (a, b) in enumerate(zip(old, new))
+            if a != b and (a == a or b == b)]
+
+
+def _parse_operation(parsed, rest):
+    fields = rest.split(None, 2)
+    parsed['name'] = fields[0]
+    parsed['handle'] = fields[1]
+    if len(fields) > 2:
+        parsed['arguments'] = fields[2]
+
+
+def _parse_operation_completed(parsed, rest):
+    fields = rest.split(None, 3)
+    parsed['name'] = fields[0]
+    parsed['handle'] = fields[1]
+    parsed['status'] = fields[2]
+    if len(fields) > 3:
+        parsed['arguments'] = fields[3]
+
+
+def _parse_string(parsed, rest, second_field):
+    fields = rest.split(None, 2)
+    parsed['name'] = fields[0]
+    if len(fields) > 1:
+        parsed[second_field] = fields[1]
+    if len(fields) > 2:
+        parsed['arguments'] = fields[2]
+
+
+def _parse_string_completed(parsed, rest):
+    # name status contents
+    _parse_string(parsed, rest, 'status')
+
+
+def _parse_configure_string(parsed, rest):
+    # name owner contents
+    _parse_string(parsed, rest, 'owner')
+
+
+def _parse_other(parsed, rest):
+    if rest:
+        parsed['arguments'] = rest
+
+
+# message type without direction -> function filling in the parsed fields
+MESSAGE_PARSERS = {
+    'start_operation': _parse_operation,
+    'operation_update': _parse_operation,
+    'operation_completed': _parse_operation_completed,
+    'set_string_completed': _parse_string_completed,
+    'configure_string': _parse_configure_string,
+}
+
+
+def _robot_parser(parsed):
+    # the parser for the robot specific contents of a message, if any
+    name = parsed['name'] or ''
+    if parsed['type'] in ('set_string_completed', 'configure_string'):
+        if name.startswith('robot_force_'):
+            return parse_robot_force_message
+        if name == 'robot_cassette':
+            return parse_robot_cassette_message
+    elif (parsed['type'] == 'start_operation' and name == 'robot_config' and
+            (parsed['arguments'] or '').startswith('probe ')):
+        return parse_start_robot_probe_message
+    return None
+
+
+def parse_message(message, compact=False):
+
+    """
+    Parses any message, routing on the message type.
+    Returns a dictionary with:
+      * direction: message direction (stog, stoh, gtos, htos, stoc)
+      * type: message type without the direction (str)
+      * name: operation or string name (str or None)
+      * handle: operation handle (str or None)
+      * status: operation or string completion status (str or None)
+      * owner: owner of a configured string (str or None)
+      * arguments: remaining arguments (str or None)
+      * details: for robot cassette, force and probe messages the result
+        of their parser, called with compact, otherwise None
+    Raises ValueError if the message is malformed for its type.
+    """
+
+    msg_type, _, rest = message.partition(' ')
+    direction, _, msg_type = msg_type.partition('_')
+    parsed = {
+        'direction': direction,
+        'type': msg_type,
+        'name': None,
+        'handle': None,
+        'status': None,
+        'owner': None,
+        'arguments': None,
+        'details': None,
+    }
+    parser = MESSAGE_PARSERS.get(msg_type, _parse_other)
+    try:
+        parser(parsed, rest.strip())
+    except IndexError:
+        raise ValueError('Malformed %s message: %r' % (msg_type, message))
+    robot_parser = _robot_parser(parsed)
+    if robot_parser is not None:
+        try:
+            robot_message = message
+            if msg_type == 'configure_string':
+                # the robot parsers expect the contents right after the name
+                robot_message = '%s %s' % (parsed['name'],
+                                           parsed['arguments'] or '')
+            parsed['details'] = robot_parser(robot_message, compact)
+        except (AttributeError, IndexError):
+            # the robot regular expressions did not match
+            raise ValueError('Malformed %s message: %r' % (msg_type, message))
+    return parsed
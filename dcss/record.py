@@ -0,0 +1,80 @@
+# Recording of raw XOS traffic and fast replay of recorded sessions.
+#
+# A recording starts with MAGIC, followed by one record per frame: a RECORD
+# header (timestamp, direction, message length, data length) then the
+# message and data bytes.
+import struct
+import threading
+import time
+
+MAGIC = b'DCSSREC1'
+RECORD = struct.Struct('<dBII')
+
+RECEIVED = 0
+SENT = 1
+
+
+class Recorder(object):
+    """Appends frames to a recording, set it as the recorder of a DCSS"""
+
+    def __init__(self, path):
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        # frames are sent from operation handler threads too
+        self.lock = threading.Lock()
+
+    def record(self, direction, msg, data=b''):
+        header = RECORD.pack(time.time(), direction, len(msg), len(data))
+        with self.lock:
+            self.file.write(header + msg + data)
+
+    def record_frames(self, direction, frames):
+        """Record (msg, data) frames, flushing them to the file"""
+        now = time.time()
+        records = [RECORD.pack(now, direction, len(msg), len(data)) + msg + data
+                   for msg, data in frames]
+        with self.lock:
+            self.file.write(b''.join(records))
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_records(path):
+    """Yield (timestamp, direction, msg, data) for every recorded frame"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a dcss recording' % path)
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            timestamp, direction, msg_len, data_len = RECORD.unpack(header)
+            msg = f.read(msg_len)
+            data = f.read(data_len)
+            yield timestamp, direction, msg, data
+
+
+def replay(path, target):
+    """Feed the received frames of a recording through target.
+
+    target is a Client, Runs or Server, it does not need to be connected.
+    Messages only go through process_frame, so they update state and reach
+    subscribers, but server operation handlers are never run. Messages are
+    processed as fast as possible. Returns (messages, seconds).
+    """
+    frames = [(msg, data) for _, direction, msg, data in read_records(path)
+              if direction == RECEIVED]
+    start = time.perf_counter()
+    for msg, data in frames:
+        target.process_frame(msg, data)
+    return len(frames), time.perf_counter() - start
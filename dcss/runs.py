@@ -1,7 +1,7 @@
-from .client import Client, ready
+from .client import Client, needs, ready
+from .dcss import make_deadline, remaining
 
 import pprint
-from collections import OrderedDict
 
 RUN_KEYS = ['status',
             'next_frame',
@@ -29,29 +29,114 @@ RUN_KEYS = ['status',
 
 RUN_KEY_ALIAS = {'prefix': 'file_root', 'energy': 'energy1'}
 
+RUN_MESSAGES = ('stog_set_string_completed run', 'stog_configure_string run')
+
+
+class RunRecord(object):
+    """The fields of one runN string, readable like a dict"""
+
+    __slots__ = tuple(RUN_KEYS)
+
+    def __init__(self, values=()):
+        values = list(values)
+        values.extend([None] * (len(RUN_KEYS) - len(values)))
+        for key, value in zip(RUN_KEYS, values):
+            setattr(self, key, value)
+
+    @classmethod
+    def from_string(cls, contents):
+        return cls(contents.split())
+
+    def to_string(self):
+        return ' '.join(value for value in self.values() if value is not None)
+
+    def updated(self, **kwargs):
+        """Copy with kwargs applied, None values and unknown keys ignored"""
+        record = RunRecord(self.values())
+        for key, value in kwargs.items():
+            if value is None:
+                continue
+            key = RUN_KEY_ALIAS.get(key, key)
+            if key in self.__slots__:
+                setattr(record, key, str(value))
+        return record
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return list(RUN_KEYS)
+
+    def values(self):
+        return [getattr(self, key) for key in RUN_KEYS]
+
+    def items(self):
+        return list(zip(RUN_KEYS, self.values()))
+
+    def __eq__(self, other):
+        return isinstance(other, RunRecord) and self.values() == other.values()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'RunRecord(%r)' % (dict(self.items()), )
+
+
+class RunBatch(object):
+    """Collects run changes and sends them together when the block ends"""
+
+    def __init__(self, runs):
+        self.runs = runs
+        self.changes = {}
+
+    def set_run(self, run_id, **kwargs):
+        self.changes.setdefault(run_id, {}).update(kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.runs.set_runs(self.changes)
+
 
 class Runs(Client):
     def __init__(self, *args, **kwargs):
         super(Runs, self).__init__(*args, **kwargs)
 
         self.runs = {}
+        # contents of the run strings as last received
+        self.run_strings = {}
+        for prefix in RUN_MESSAGES:
+            self.subscribe(prefix, self._run_string)
+
+    def _run_string(self, msg):
+        fields = msg.split(None, 3)
+        if len(fields) < 3:
+            return
+        string_name = fields[1]
+        contents = fields[3] if len(fields) > 3 else ''  # skip owner
+        if self.run_strings.get(string_name) == contents:
+            return
+        if string_name == 'runs':
+            self.runs[string_name] = contents.split()
+        elif string_name[3:].isdigit():
+            self.runs[string_name] = RunRecord.from_string(contents)
+        else:
+            return
+        self.run_strings[string_name] = contents
 
-    def _process_message(self, msg):
-        super(Runs, self)._process_message(msg)
-
-        if (msg.startswith('stog_set_string_completed run') or
-            msg.startswith('stog_configure_string run')):
-
-            string_name, data = msg.split(None, 2)[1:]
-            data = data.split()[1:]  # remove self
-            if string_name == 'runs':
-                self.runs[string_name] = data
-
-            try:
-                run_no = int(string_name[3:])  # noqa Needed?
-                self.runs[string_name] = OrderedDict(zip(RUN_KEYS, data))
-            except ValueError:
-                pass
+    def _connection_lost(self):
+        super(Runs, self)._connection_lost()
+        self.runs = {}
+        self.run_strings = {}
 
     def add_run(self):
         self.run_operation('runsConfig', self.user, 'addNewRun')
@@ -63,40 +148,65 @@ class Runs(Client):
     def reset_run(self, run_no):
         self.run_operation('runsConfig', self.user, 'resetRun', run_no)
 
+    def reset_runs(self, run_numbers, timeout=None):
+        """Reset several runs at once, returns {run_no: completion message}.
+
+        timeout, or else self.timeout, bounds the whole call.
+        """
+        deadline = make_deadline(self.timeout if timeout is None else timeout)
+        futures = {}
+        for run_no in run_numbers:
+            futures[run_no] = self.run_operation(
+                'runsConfig', self.user, 'resetRun', run_no, wait=False,
+                timeout=remaining(deadline))
+        results = self.wait_for_operations(futures.values(),
+                                           remaining(deadline))
+        return dict(zip(futures, results))
+
     def reset_all(self):
         # resetAllRuns command fails
-        # so we will just loop and do all manually
-        for i in range(17):
-            self.reset_run(i)
+        # so we will reset all of them individually
+        return self.reset_runs(range(17))
 
     def hide_all(self):
         self.show_runs(0)
 
-    @ready
+    @needs('runs')
     def show_if_hidden(self, run_no):
         if int(self.runs['runs'][0]) < int(run_no):
             self.show_runs(run_no)
 
-    @ready
+    @needs('runs')
     def show_runs(self, run_no):
-        runs_settings = self.runs['runs']
+        runs_settings = list(self.runs['runs'])
         runs_settings[0] = str(run_no)
         runs_settings[1] = str(run_no)
 
         self.set_string('runs', " ".join(runs_settings))
 
-    @ready
-    def set_run(self, run_id, **kwargs):
-        current = self.runs[run_id]
-        for key, value in kwargs.iteritems():
-            if value is None:
-                continue
-            if key in RUN_KEYS:
-                current[key] = str(value)
-            if key in RUN_KEY_ALIAS:
-                current[RUN_KEY_ALIAS[key]] = str(value)
-
-        self.set_string(run_id, " ".join(current.values()))
+    def set_run(self, run_id, timeout=None, **kwargs):
+        """Update a run, returns False without sending if nothing changed"""
+        return bool(self.set_runs({run_id: kwargs}, timeout=timeout))
+
+    def set_runs(self, changes, timeout=None):
+        """Update several runs from {run_id: kwargs} in one round trip.
+
+        Only runs that actually change are sent, their names are returned.
+        timeout, or else self.timeout, bounds the whole call.
+        """
+        deadline = make_deadline(self.timeout if timeout is None else timeout)
+        self.wait_for_devices(changes, remaining(deadline))
+        pending = {}
+        for run_id, kwargs in changes.items():
+            updated = self.runs[run_id].updated(**kwargs)
+            if updated != self.runs[run_id]:
+                pending[run_id] = updated.to_string()
+        self.set_strings(pending, remaining(deadline))
+        return list(pending)
+
+    def batch(self):
+        """Context manager staging set_run calls, sent together on exit"""
+        return RunBatch(self)
 
     @ready
     def start_run(self, run_no, **kwargs):
@@ -113,7 +223,7 @@ class Runs(Client):
 
     @ready
     def get_active_run(self):
-        for run_str, data in self.runs.iteritems():
+        for run_str, data in self.runs.items():
             if run_str == 'runs':
                 continue
             if data.get('status') == 'active':
@@ -1,13 +1,82 @@
+import logging
+import multiprocessing
 import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from .dcss import DCSS
 
 
+# dcss messages for hardware servers, methods with these prefixes handle them
+HANDLER_PREFIXES = ('stoh_', 'stoc_')
+
+
+def handler_table(obj):
+    """Map message types to the bound methods of obj that handle them"""
+    return {attr: getattr(obj, attr)
+            for attr in dir(type(obj)) if attr.startswith(HANDLER_PREFIXES)}
+
+
+def in_process(func):
+    """Mark an operation handler to run in a worker process.
+
+    For CPU bound handlers the GIL would otherwise serialize. The handler
+    must be picklable, so a module level function or a staticmethod with
+    ``@staticmethod`` applied last. It is called with a ProcessOperationHandle.
+    """
+    func.in_process = True
+    return func
+
+
+# set in worker processes by ProcessOperations, see _init_worker
+_worker_queue = None
+
+
+def _init_worker(queue):
+    global _worker_queue
+    _worker_queue = queue
+
+
+UPDATE_FMT = 'htos_operation_update {name} {handle} {args}'
+
+
 class OperationHandle(object):
-    def __init__(self, dcss, name, handle):
+    """Sends the updates and completion of one operation to dcss.
+
+    With ``max_update_rate`` at most that many updates per second are sent,
+    an update arriving sooner replaces any update still waiting and is sent
+    by a timer. A waiting update is always sent before the completion.
+    """
+
+    def __init__(self, dcss, name, handle, max_update_rate=None):
         self.dcss = dcss
         self.name = name
         self.handle = handle
+        self.started = time.monotonic()
+
+        self.max_update_rate = max_update_rate
+        self.lock = threading.Lock()
+        self.timer = None
+        # arguments of the latest update not sent yet
+        self.pending_update = None
+        self.last_update = 0
+
+    def __getstate__(self):
+        # locks and timers do not pickle, see ProcessOperationHandle
+        state = dict(self.__dict__)
+        state['lock'] = state['timer'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def _observe(self):
+        # latency from start to completion, when the server keeps metrics
+        metrics = getattr(self.dcss, 'metrics', None)
+        if metrics is not None:
+            metrics.observe(self.name, time.monotonic() - self.started)
 
     def _send_formatted_msg(self, fmt, args):
         arg_str = ' '.join(str(arg) for arg in args)
@@ -15,29 +84,232 @@ class OperationHandle(object):
         self.dcss.send_xos3(msg)
 
     def operation_completed(self, *args):
+        self.flush_update()
         fmt = 'htos_operation_completed {name} {handle} normal {args}'
         self._send_formatted_msg(fmt, args)
+        self._observe()
 
     def operation_error(self, *args):
+        self.flush_update()
         fmt = 'htos_operation_completed {name} {handle} error {args}'
         self._send_formatted_msg(fmt, args)
+        self._observe()
 
     def operation_update(self, *args):
-        fmt = 'htos_operation_update {name} {handle} {args}'
-        self._send_formatted_msg(fmt, args)
+        if self.max_update_rate is None:
+            self._send_formatted_msg(UPDATE_FMT, args)
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait = self.last_update + 1.0 / self.max_update_rate - now
+            if wait <= 0 and self.timer is None:
+                self.last_update = now
+                self._send_formatted_msg(UPDATE_FMT, args)
+                return
+            self.pending_update = args
+            if self.timer is None:
+                self.timer = threading.Timer(wait, self.flush_update)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush_update(self):
+        """Send the update held back by max_update_rate, if any"""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            args, self.pending_update = self.pending_update, None
+            if args is not None:
+                self.last_update = time.monotonic()
+                self._send_formatted_msg(UPDATE_FMT, args)
 
     def __repr__(self):
         cls_name = self.__class__.__name__
         return '<{} [{}]: {}>'.format(cls_name, self.handle, self.name)
 
 
+class QueueSender(object):
+    """Stands in for the server, sending through the worker queue"""
+
+    def __init__(self, queue=None):
+        # None uses the queue installed in this worker process
+        self.queue = queue
+
+    def send_xos3(self, msg, data=b''):
+        queue = self.queue if self.queue is not None else _worker_queue
+        queue.put((msg, data))
+
+
+class ProcessOperationHandle(OperationHandle):
+    """Picklable OperationHandle sending through the worker queue"""
+
+    def __init__(self, name, handle, max_update_rate=None):
+        super(ProcessOperationHandle, self).__init__(QueueSender(), name,
+                                                     handle, max_update_rate)
+
+
+class ProcessOperations(object):
+    """Runs in_process handlers on a process pool.
+
+    Messages the handlers send come back on a queue and are sent on by a
+    thread in the parent, through ``dcss.send_xos3``.
+    """
+
+    def __init__(self, dcss, max_workers=None):
+        self.dcss = dcss
+        self.queue = multiprocessing.Queue()
+        self.pool = ProcessPoolExecutor(max_workers, initializer=_init_worker,
+                                        initargs=(self.queue, ))
+        self.relay = threading.Thread(target=self._relay)
+        self.relay.daemon = True
+        self.relay.start()
+        self.log = logging.getLogger('DCSS')
+
+    def _relay(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            self.dcss.send_xos3(*item)
+
+    def run(self, func, operation, *args):
+        """Run func in a worker process, waiting for it on this thread.
+
+        Meant to be submitted to an OperationExecutor. If the handler fails,
+        or its arguments do not pickle, the operation completes with an
+        error so dcss is not left waiting.
+        """
+        try:
+            self.pool.submit(func, operation, *args).result()
+        except Exception as error:
+            self.log.exception('Operation %s failed', operation.name)
+            # through the queue, after whatever the handler sent
+            OperationHandle(QueueSender(self.queue), operation.name,
+                            operation.handle).operation_error(error)
+        finally:
+            # workers have no metrics, time the operation here
+            metrics = getattr(self.dcss, 'metrics', None)
+            if metrics is not None:
+                metrics.observe(operation.name,
+                                time.monotonic() - operation.started)
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait)
+        self.queue.put(None)
+        if wait:
+            self.relay.join()
+
+
+class OperationExecutor(object):
+    """Runs operation handlers on a bounded thread pool.
+
+    At most ``max_workers`` handlers run at once and at most ``max_queue``
+    wait for a worker, ``submit`` refuses work beyond that. ``limits`` maps
+    operation names to how many of them may run at the same time. If a
+    handler raises, the ``operation`` given to ``submit`` completes with
+    the error so dcss is not left waiting.
+    """
+
+    def __init__(self, max_workers=8, max_queue=64, limits=None):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.limits = dict(limits or {})
+        self.pool = ThreadPoolExecutor(max_workers)
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        # (name, func, args, operation) waiting for a worker
+        self.queue = deque()
+        # number of running handlers per operation name
+        self.running = {}
+        self.active = 0
+        self.log = logging.getLogger('DCSS')
+
+    @property
+    def queue_depth(self):
+        return len(self.queue)
+
+    @property
+    def active_workers(self):
+        return self.active
+
+    def submit(self, name, func, *args, operation=None):
+        with self.lock:
+            if len(self.queue) >= self.max_queue:
+                return False
+            self.queue.append((name, func, args, operation))
+            self._dispatch()
+        return True
+
+    def _dispatch(self):
+        # start queued work that fits the limits, called with the lock held
+        skipped = []
+        while self.queue and self.active < self.max_workers:
+            name, func, args, operation = item = self.queue.popleft()
+            limit = self.limits.get(name)
+            if limit is not None and self.running.get(name, 0) >= limit:
+                skipped.append(item)
+                continue
+            self.running[name] = self.running.get(name, 0) + 1
+            self.active += 1
+            self.pool.submit(self._run, name, func, args, operation)
+        self.queue.extendleft(reversed(skipped))
+
+    def _run(self, name, func, args, operation):
+        try:
+            func(*args)
+        except Exception as error:
+            self.log.exception('Operation %s failed', name)
+            if operation is not None:
+                operation.operation_error(error)
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.running[name] -= 1
+                if not self.running[name]:
+                    del self.running[name]
+                self._dispatch()
+                if not self.active:
+                    self.idle.notify_all()
+
+    def shutdown(self, wait=True):
+        if wait:
+            # queued work is only handed to the pool as workers free up
+            with self.lock:
+                while self.active:
+                    self.idle.wait()
+        self.pool.shutdown(wait)
+
+
 class Server(DCSS):
     """Distributed Hardware Server"""
 
-    def __init__(self, name, server):
+    # dcss asks for our client type with a XOS1 message, the rest is XOS3
+    xos1_frames = 1
+    internal_prefixes = tuple(prefix.encode('utf-8')
+                              for prefix in HANDLER_PREFIXES)
+
+    def __init__(self, name, server, executor=None):
         super(Server, self).__init__(server=server, port=14242)
         self.name = name
-        self.threads = []
+        if executor is None:
+            executor = OperationExecutor()
+        self.executor = executor
+        # started on the first in_process operation
+        self.processes = None
+        self.process_workers = None
+        # updates per second each operation may send, None sends them all
+        self.max_update_rate = None
+        self.handlers = handler_table(self)
+        # counts of received message types we have no handler for
+        self.unhandled = Counter()
+
+    @property
+    def queue_depth(self):
+        return self.executor.queue_depth
+
+    @property
+    def active_workers(self):
+        return self.executor.active_workers
 
     def login(self):
         msg = self.read_message_xos1()
@@ -50,26 +322,38 @@ class Server(DCSS):
 
     def stoh_start_operation(self, name, handle, *args):
         func = getattr(self, name, None)
-        if func is not None:
-            handler = OperationHandle(self, name, handle)
-            targs = [handler]
-            targs.extend(args)
-            t = threading.Thread(target=func, args=targs)
-            self.threads.append(t)
-            t.start()
-        else:
+        if func is None:
             self.log.warning('Operation %s is unhandled' % name)
+            return
+        handler = OperationHandle(self, name, handle, self.max_update_rate)
+        if getattr(func, 'in_process', False):
+            if self.processes is None:
+                self.processes = ProcessOperations(self, self.process_workers)
+            # an executor thread waits for the worker process, so the same
+            # queue and limits apply
+            work = (self.processes.run, func,
+                    ProcessOperationHandle(name, handle, self.max_update_rate))
+        else:
+            work = (func, handler)
+        if not self.executor.submit(name, *(work + args), operation=handler):
+            self.log.warning('Operation queue full, rejecting %s', name)
+            handler.operation_error('busy')
+
+    def close(self):
+        super(Server, self).close()
+        if self.processes is not None:
+            self.processes.shutdown()
+            self.processes = None
+
+    def handle_message(self, msg):
+        func_name, _, args = msg.partition(' ')
+        func = self.handlers.get(func_name)
+        if func is not None:
+            func(*args.split())
+        elif func_name:
+            self.unhandled[func_name] += 1
 
     def loop(self):
         while True:
             for msg in self.process_messages():
-                try:
-                    func_name, args = msg.split(None, 1)
-                except ValueError:
-                    # Bad recv
-                    continue
-                func = getattr(self, func_name, None)
-                if func is not None:
-                    func(*args.split())
-                else:
-                    self.log.info('DCSS function %s is not supported' % func_name)
+                self.handle_message(msg)
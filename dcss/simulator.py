@@ -0,0 +1,284 @@
+# Local stand-in for dcss to exercise Client and Server over real sockets.
+#
+#   python -m dcss.simulator
+import itertools
+import logging
+import socket
+import threading
+import time
+
+from .framing import XOS1_LENGTH, FrameDecoder, encode_xos3
+
+DEFAULT_STRINGS = {
+    'runs': '0 0 1',
+    'run0': 'inactive 0 1 test /data/test 1 Phi 0.0 180.0 1.0 180 1.0 300.0 '
+            '40.0 0.0 1 12658.0 0.0 0.0 0.0 0.0 0 0',
+}
+DEFAULT_MOTORS = {'sample_x': 0.0, 'sample_y': 0.0, 'sample_z': 0.0}
+
+
+class Session(object):
+    """One gui or hardware connection to the simulator"""
+
+    def __init__(self, simulator, sock, kind):
+        self.simulator = simulator
+        self.socket = sock
+        self.kind = kind
+        self.name = None
+        self.send_lock = threading.Lock()
+        # logins are XOS1, everything after that XOS3
+        self.decoder = FrameDecoder(xos1_frames=1)
+
+    def send(self, msg):
+        try:
+            with self.send_lock:
+                self.socket.sendall(encode_xos3(msg))
+        except socket.error:
+            pass
+
+    def send_xos1(self, msg):
+        with self.send_lock:
+            self.socket.sendall(msg.encode('utf-8').ljust(XOS1_LENGTH, b'\0'))
+
+    def run(self):
+        try:
+            if self.kind == 'gui':
+                self.send('stoc_send_client_type')
+            else:
+                self.send_xos1('stoc_send_client_type')
+            while True:
+                data = self.socket.recv(65536)
+                if not data:
+                    break
+                for msg, _ in self.decoder.feed(data):
+                    msg = msg.rstrip(b'\0').decode('utf-8')
+                    self.simulator.handle(self, msg.strip())
+        except socket.error:
+            pass
+        finally:
+            self.simulator.disconnected(self)
+            self.socket.close()
+
+
+class Simulator(object):
+    """Speaks the dcss gui (XOS3) and hardware (XOS1 login, then XOS3) ports.
+
+    Guis are logged in and sent a dump of ``strings`` and ``motors``. They
+    can become master, set strings and run operations. Operations listed in
+    ``operation_owners`` are forwarded to that hardware server, others are
+    completed by the simulator after ``operation_delay`` seconds. Pass port
+    0 to listen on a free port, see ``gui_port`` and ``hardware_port``.
+    """
+
+    def __init__(self, host='127.0.0.1', gui_port=14243, hardware_port=14242,
+                 strings=None, motors=None, operation_owners=None,
+                 operation_delay=0):
+        self.host = host
+        self.strings = dict(DEFAULT_STRINGS if strings is None else strings)
+        self.motors = dict(DEFAULT_MOTORS if motors is None else motors)
+        self.operation_owners = dict(operation_owners or {})
+        self.operation_delay = operation_delay
+
+        self.listeners = {
+            'gui': self._listen(gui_port),
+            'hardware': self._listen(hardware_port),
+        }
+        self.guis = []
+        self.hardware = {}
+        self.master = None
+        self.client_ids = itertools.count(1)
+        self.handles = itertools.count(1)
+        # htos_operation_completed messages received from hardware servers
+        self.completed = []
+        self.condition = threading.Condition()
+        self.threads = []
+        self.log = logging.getLogger('DCSS')
+
+    def _listen(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, port))
+        sock.listen(64)
+        return sock
+
+    @property
+    def gui_port(self):
+        return self.listeners['gui'].getsockname()[1]
+
+    @property
+    def hardware_port(self):
+        return self.listeners['hardware'].getsockname()[1]
+
+    def _spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def start(self):
+        for kind, listener in self.listeners.items():
+            self._spawn(self._accept, kind, listener)
+        return self
+
+    def stop(self):
+        for listener in self.listeners.values():
+            listener.close()
+        with self.condition:
+            sessions = self.guis + list(self.hardware.values())
+        for session in sessions:
+            try:
+                session.socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _accept(self, kind, listener):
+        while True:
+            try:
+                sock, _ = listener.accept()
+            except socket.error:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._spawn(Session(self, sock, kind).run)
+
+    def disconnected(self, session):
+        with self.condition:
+            if session in self.guis:
+                self.guis.remove(session)
+            if self.hardware.get(session.name) is session:
+                del self.hardware[session.name]
+            if self.master is session:
+                self.master = None
+
+    def broadcast(self, msg):
+        with self.condition:
+            guis = list(self.guis)
+        for gui in guis:
+            gui.send(msg)
+
+    def send_dump(self, session):
+        for name, contents in sorted(self.strings.items()):
+            session.send('stog_configure_string %s self %s' % (name, contents))
+        for name, position in sorted(self.motors.items()):
+            session.send('stog_configure_real_motor %s simulator %s %s '
+                         '100 -100 1000 100 0.1 0 1 1 0 0 0' %
+                         (name, name, position))
+        session.send('stog_dcss_end_update_all_device')
+
+    def handle(self, session, msg):
+        msg_type, _, args = msg.partition(' ')
+        handler = getattr(self, 'on_' + msg_type, None)
+        if handler is None:
+            self.log.debug('simulator ignoring %r', msg)
+            return
+        handler(session, args)
+
+    # gui messages
+
+    def on_gtos_client_is_gui(self, session, args):
+        session.name = str(next(self.client_ids))
+        with self.condition:
+            self.guis.append(session)
+        session.send('stog_login_complete %s' % session.name)
+        self.send_dump(session)
+
+    def on_gtos_become_master(self, session, args):
+        with self.condition:
+            if self.master not in (None, session) and args != 'force':
+                session.send('stog_become_slave')
+                return
+            previous, self.master = self.master, session
+        if previous not in (None, session):
+            previous.send('stog_other_master')
+        session.send('stog_become_master')
+
+    def on_gtos_set_string(self, session, args):
+        name, _, contents = args.partition(' ')
+        self.strings[name] = contents
+        self.broadcast('stog_set_string_completed %s normal %s' %
+                       (name, contents))
+
+    def on_gtos_start_operation(self, session, args):
+        name, handle, _ = (args + ' ').split(' ', 2)
+        self.broadcast('stog_start_operation %s' % args)
+        owner = self.hardware.get(self.operation_owners.get(name))
+        if owner is not None:
+            owner.send('stoh_start_operation %s' % args)
+            return
+        completion = 'stog_operation_completed %s %s normal' % (name, handle)
+        if self.operation_delay:
+            timer = threading.Timer(self.operation_delay, self.broadcast,
+                                    [completion])
+            timer.daemon = True
+            timer.start()
+        else:
+            self.broadcast(completion)
+
+    # hardware messages
+
+    def on_htos_client_is_hardware(self, session, args):
+        session.name = args.strip()
+        with self.condition:
+            self.hardware[session.name] = session
+            self.condition.notify_all()
+
+    def on_htos_operation_update(self, session, args):
+        self.broadcast('stog_operation_update %s' % args)
+
+    def on_htos_operation_completed(self, session, args):
+        self.broadcast('stog_operation_completed %s' % args)
+        with self.condition:
+            self.completed.append(args)
+            self.condition.notify_all()
+
+    # load generation
+
+    def flood_updates(self, count, motor='sample_x'):
+        """Send count motor position updates to every gui"""
+        for i in range(count):
+            self.broadcast('stog_update_motor_position %s %d normal' %
+                           (motor, i))
+
+    def flood_operations(self, hardware_name, name, count, *args):
+        """Start count operations on a hardware server, return their handles"""
+        session = self.hardware[hardware_name]
+        arg_str = ' '.join(map(str, args))
+        handles = []
+        for _ in range(count):
+            handle = '0.%d' % next(self.handles)
+            session.send('stoh_start_operation %s %s %s' %
+                         (name, handle, arg_str))
+            handles.append(handle)
+        return handles
+
+    def wait_for_hardware(self, name, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: name in self.hardware,
+                                           timeout)
+
+    def wait_for_completed(self, count, timeout=None):
+        """Wait until count operations completed on hardware servers"""
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: len(self.completed) >= count, timeout)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    with Simulator(host='0.0.0.0') as simulator:
+        simulator.log.info('Simulating dcss on ports %s (gui) and %s (hardware)',
+                           simulator.gui_port, simulator.hardware_port)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
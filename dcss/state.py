@@ -0,0 +1,110 @@
+import logging
+
+
+class DeviceState(object):
+    """Mirror of beamline state built from the messages dcss sends a gui.
+
+    ``strings`` maps string names to their contents, ``motors`` maps motor
+    names to ``{'position': float, 'status': str}`` and ``operations`` maps
+    operation names to the last ``{'handle', 'status', 'arguments'}`` seen.
+    Callbacks registered with ``on_change`` are called with
+    ``(kind, name, value)`` whenever one of these entries changes.
+    """
+
+    def __init__(self):
+        self.strings = {}
+        self.motors = {}
+        self.operations = {}
+        self.shutters = {}
+        self.callbacks = []
+        self.log = logging.getLogger('DCSS')
+
+        # message type -> (kind, method applying the rest of the message)
+        self.appliers = {
+            'stog_configure_string': ('strings', self._apply_string),
+            'stog_set_string_completed': ('strings', self._apply_string),
+            'stog_configure_real_motor': ('motors', self._apply_motor_config),
+            'stog_configure_pseudo_motor': ('motors', self._apply_motor_config),
+            'stog_update_motor_position': ('motors', self._apply_motor),
+            'stog_motor_move_completed': ('motors', self._apply_motor),
+            'stog_start_operation': ('operations', self._apply_active),
+            'stog_operation_update': ('operations', self._apply_active),
+            'stog_operation_completed': ('operations', self._apply_completed),
+            'stog_configure_shutter': ('shutters', self._apply_shutter_config),
+            'stog_report_shutter_state': ('shutters', self._apply_shutter),
+        }
+
+    def clear(self):
+        self.strings.clear()
+        self.motors.clear()
+        self.operations.clear()
+        self.shutters.clear()
+
+    def on_change(self, callback):
+        self.callbacks.append(callback)
+        return callback
+
+    def apply(self, msg):
+        """Update the mirror from msg, return True if anything changed"""
+        msg_type, _, rest = msg.partition(' ')
+        applier = self.appliers.get(msg_type)
+        if applier is None:
+            return False
+        kind, func = applier
+        try:
+            name, value = func(rest)
+        except (IndexError, ValueError):
+            self.log.warning('Could not apply %r', msg)
+            return False
+        entries = getattr(self, kind)
+        if entries.get(name) == value:
+            return False
+        entries[name] = value
+        for callback in self.callbacks:
+            callback(kind, name, value)
+        return True
+
+    def _apply_string(self, rest):
+        # name, then owner or status, then contents
+        fields = rest.split(None, 2)
+        contents = fields[2] if len(fields) > 2 else ''
+        return fields[0], contents
+
+    def _apply_motor_config(self, rest):
+        # name hardwareHost hardwareName position upperLimit lowerLimit ...
+        fields = rest.split(None, 4)
+        motor = dict(self.motors.get(fields[0], {}))
+        motor['position'] = float(fields[3])
+        motor.setdefault('status', 'normal')
+        return fields[0], motor
+
+    def _apply_motor(self, rest):
+        # name position status
+        fields = rest.split(None, 3)
+        motor = dict(self.motors.get(fields[0], {}))
+        motor['position'] = float(fields[1])
+        motor['status'] = fields[2] if len(fields) > 2 else 'normal'
+        return fields[0], motor
+
+    def _apply_active(self, rest):
+        # name handle arguments, from both starts and updates
+        fields = rest.split(None, 2)
+        arguments = fields[2] if len(fields) > 2 else None
+        return fields[0], {'handle': fields[1], 'status': 'active',
+                           'arguments': arguments}
+
+    def _apply_completed(self, rest):
+        name, handle, status_args = rest.split(None, 2)
+        status, _, arguments = status_args.partition(' ')
+        return name, {'handle': handle, 'status': status,
+                      'arguments': arguments or None}
+
+    def _apply_shutter_config(self, rest):
+        # name hardwareHost state
+        fields = rest.split()
+        return fields[0], fields[2]
+
+    def _apply_shutter(self, rest):
+        # name state
+        fields = rest.split()
+        return fields[0], fields[1]
@@ -10,4 +10,5 @@ setup(
     license='MIT',
     url='https://github.com/AustralianSynchrotron/pydcss',
     packages=['dcss'],
+    python_requires='>=3.7',
 )
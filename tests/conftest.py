@@ -0,0 +1,40 @@
+import socket
+
+import pytest
+
+from dcss.framing import FrameDecoder, encode_xos3
+
+
+class Peer(object):
+    """The dcss end of a socket pair"""
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.decoder = FrameDecoder()
+
+    def send(self, *messages):
+        self.socket.sendall(b''.join(encode_xos3(msg) for msg in messages))
+
+    def received(self, count):
+        frames = []
+        while len(frames) < count:
+            frames.extend(self.decoder.feed(self.socket.recv(65536)))
+        return [msg.decode() for msg, _ in frames]
+
+
+@pytest.fixture
+def connect():
+    """Connects a logged in client to a Peer playing dcss"""
+    sockets = []
+
+    def connect(client):
+        ours, theirs = socket.socketpair()
+        sockets.extend([ours, theirs])
+        client.socket = ours
+        client.client_id = '5'
+        client.master = True
+        return Peer(theirs)
+
+    yield connect
+    for sock in sockets:
+        sock.close()
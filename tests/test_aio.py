@@ -0,0 +1,117 @@
+import asyncio
+
+from dcss.aio import AsyncClient, AsyncServer
+from dcss.framing import FrameDecoder, encode_xos3
+
+
+class FakeDCSS(object):
+    """Answers gui logins and requests with canned messages"""
+
+    def __init__(self, xos1_greeting=False):
+        self.xos1_greeting = xos1_greeting
+        self.received = []
+        self.writer = None
+        self.connected = asyncio.Event()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def handle(self, reader, writer):
+        self.writer = writer
+        if self.xos1_greeting:
+            writer.write(b'stoc_send_client_type'.ljust(200, b'\0'))
+        else:
+            writer.write(encode_xos3('stoc_send_client_type'))
+        login = (await reader.readexactly(200)).strip(b' \0').decode()
+        self.received.append(login)
+        if login.startswith('gtos_client_is_gui'):
+            writer.write(encode_xos3('stog_login_complete 7'))
+        self.connected.set()
+        decoder = FrameDecoder()
+        while True:
+            data = await reader.read(1024)
+            if not data:
+                break
+            for msg, _ in decoder.feed(data):
+                self.respond(msg.decode())
+
+    def respond(self, msg):
+        self.received.append(msg)
+        cmd, _, args = msg.partition(' ')
+        if cmd == 'gtos_become_master':
+            self.send('stog_become_master')
+        elif cmd == 'gtos_start_operation':
+            name, handle, args = args.split(None, 2)
+            self.send('stog_operation_completed %s %s normal %s' %
+                      (name, handle, args))
+        elif cmd == 'gtos_set_string':
+            self.send('stog_set_string_completed %s blctl %s' %
+                      tuple(args.split(None, 1)))
+
+    def send(self, msg):
+        self.writer.write(encode_xos3(msg))
+
+    def close(self):
+        self.writer.close()
+        self.server.close()
+
+
+def test_client_login_and_requests():
+    async def scenario():
+        dcss = FakeDCSS()
+        port = await dcss.start()
+        client = AsyncClient('127.0.0.1', 'abc')
+        client.port = port
+        await client.connect()
+        assert client.client_id == '7'
+        assert dcss.received == ['gtos_client_is_gui blctl abc who_cares :0.0']
+
+        results = await asyncio.gather(
+            client.run_operation('moveSample', 1, 2),
+            client.run_operation('moveSample', 3),
+            client.set_string('runs', '0 0 1'),
+        )
+        assert results == [
+            'stog_operation_completed moveSample 7.0 normal 1 2',
+            'stog_operation_completed moveSample 7.1 normal 3',
+            'stog_set_string_completed runs blctl 0 0 1',
+        ]
+        assert client.master
+        client.close()
+        dcss.close()
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
+
+
+class MyDHS(AsyncServer):
+    async def centre(self, operation, *args):
+        operation.operation_completed('centred', *args)
+
+    def home(self, operation):
+        operation.operation_completed('homed')
+
+
+def test_server_runs_operations():
+    async def scenario():
+        dcss = FakeDCSS(xos1_greeting=True)
+        port = await dcss.start()
+        dhs = MyDHS('my_dhs', '127.0.0.1')
+        dhs.port = port
+        task = asyncio.ensure_future(dhs.run())
+        await dcss.connected.wait()
+        dcss.send('stoh_start_operation centre 1.1 x')
+        dcss.send('stoh_start_operation home 1.2')
+        for _ in range(100):
+            if len(dcss.received) == 3:
+                break
+            await asyncio.sleep(0.01)
+        assert dcss.received[0] == 'htos_client_is_hardware my_dhs'
+        assert sorted(dcss.received[1:]) == [
+            'htos_operation_completed centre 1.1 normal centred x',
+            'htos_operation_completed home 1.2 normal homed',
+        ]
+        dcss.close()
+        await asyncio.wait_for(task, 1)
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
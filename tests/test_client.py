@@ -0,0 +1,193 @@
+import socket
+import time
+
+import pytest
+
+from dcss.client import Client, ready
+from dcss.dcss import Timeout
+from dcss.framing import encode_xos3
+
+
+@pytest.fixture
+def connection(connect):
+    client = Client('localhost', 'abc')
+    return client, connect(client)
+
+
+def test_run_operation(connection):
+    client, dcss = connection
+    dcss.send('stog_operation_completed moveSample 5.0 normal done')
+    result = client.run_operation('moveSample', 1)
+    assert result == 'stog_operation_completed moveSample 5.0 normal done'
+    assert dcss.received(1) == ['gtos_start_operation moveSample 5.0 1']
+
+
+def test_pipelined_operations_are_matched_by_handle(connection):
+    client, dcss = connection
+    first = client.run_operation('moveSample', 1, wait=False)
+    second = client.run_operation('moveSample', 2, wait=False)
+    assert dcss.received(2) == ['gtos_start_operation moveSample 5.0 1',
+                                'gtos_start_operation moveSample 5.1 2']
+    dcss.send('stog_operation_completed moveSample 3.9 normal other client',
+              'stog_operation_completed moveSample 5.1 normal two',
+              'stog_operation_completed moveSample 5.0 normal one')
+    assert client.wait_for_operations([first, second]) == [
+        'stog_operation_completed moveSample 5.0 normal one',
+        'stog_operation_completed moveSample 5.1 normal two',
+    ]
+    assert client.operations == {}
+
+
+def test_cancelled_operation_future_is_left_alone(connection):
+    client, dcss = connection
+    first = client.run_operation('moveSample', 1, wait=False)
+    second = client.run_operation('moveSample', 2, wait=False)
+    assert first.cancel()
+    dcss.send('stog_operation_completed moveSample 5.0 normal one',
+              'stog_operation_completed moveSample 5.1 normal two')
+    assert client.wait_for_operations([second]) == [
+        'stog_operation_completed moveSample 5.1 normal two']
+    assert first.cancelled()
+    assert client.operations == {}
+
+
+def test_cancelled_operation_future_survives_connection_loss(connection):
+    client, dcss = connection
+    future = client.run_operation('moveSample', 1, wait=False)
+    future.cancel()
+    client._connection_lost()
+    assert future.cancelled()
+    assert client.operations == {}
+
+
+def test_state_is_mirrored(connection):
+    client, dcss = connection
+    dcss.send('stog_configure_string runs self 1 0 1',
+              'stog_dcss_end_update_all_device')
+    client.process_until('stog_dcss_end_update_all_device')
+    assert client.ready
+    assert client.get_string('runs') == '1 0 1'
+
+
+def test_process_until_times_out_keeping_partial_frame(connection):
+    client, dcss = connection
+    packet = encode_xos3('stog_become_master')
+    dcss.socket.sendall(packet[:30])
+    with pytest.raises(Timeout):
+        client.process_until('stog_become_master', timeout=0.05)
+    dcss.socket.sendall(packet[30:])
+    assert client.process_until('stog_become_master', timeout=1)
+    assert client.socket.gettimeout() is None
+
+
+def test_ready_uses_client_timeout(connection):
+    client, dcss = connection
+    client.timeout = 0.05
+    with pytest.raises(Timeout):
+        ready(lambda self: None)(client)
+
+
+def test_run_operation_timeout_leaves_operation_pending(connection):
+    client, dcss = connection
+    with pytest.raises(Timeout):
+        client.run_operation('moveSample', timeout=0.05)
+    assert list(client.operations) == ['5.0']
+
+
+def test_run_operation_uses_client_timeout_for_the_whole_call(connection):
+    client, dcss = connection
+    client.master = False
+    client.timeout = 0.2
+    dcss.send('stog_become_master')
+    start = time.monotonic()
+    with pytest.raises(Timeout):
+        client.run_operation('moveSample')
+    assert time.monotonic() - start < 0.5
+
+
+def test_connect_gives_up_at_the_deadline():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    client = Client('127.0.0.1', 'abc')
+    client.port = port
+    start = time.monotonic()
+    with pytest.raises(Timeout):
+        client.process_until('stog_dcss_end_update_all_device', timeout=0.3)
+    assert time.monotonic() - start < 1
+
+
+def test_filtered_messages_are_not_processed(connection):
+    client, dcss = connection
+    client.filter_messages('stog_update_motor_position sample_x ')
+    dcss.send('stog_update_motor_position sample_y 1.0 normal',
+              'stog_configure_string runs self 1 0 1',
+              'stog_update_motor_position sample_x 2.0 normal',
+              'stog_report_shutter_state shutter open')
+    assert client.read_message()[0] == 'stog_configure_string runs self 1 0 1'
+    assert client.read_message()[0].startswith('stog_update_motor_position '
+                                               'sample_x')
+    assert client.process_pending() == []
+    assert list(client.state.motors) == ['sample_x']
+    assert client.state.shutters == {}
+
+
+def test_stream_operation(connection):
+    client, dcss = connection
+    stream = client.stream_operation('robot_config', 'probe')
+    dcss.send('stog_operation_update robot_config 5.0 probing 1',
+              'stog_operation_update robot_config 4.0 other client',
+              'stog_operation_update robot_config 5.0 probing 2',
+              'stog_operation_completed robot_config 5.0 normal done')
+    messages = list(stream)
+    assert dcss.received(1) == ['gtos_start_operation robot_config 5.0 probe']
+    assert [msg['arguments'] for msg in messages] == [
+        'probing 1', 'probing 2', 'done']
+    assert messages[-1]['status'] == 'normal'
+    assert client.routes == {}
+
+
+def test_stream_operation_keeps_latest_updates(connection):
+    client, dcss = connection
+    client.filter_messages('stog_become_master')
+    stream = client.stream_operation('collectRun', max_pending=2)
+    dcss.send('stog_operation_update collectRun 5.0 frame 0')
+    assert next(stream)['arguments'] == 'frame 0'
+    dcss.send(*['stog_operation_update collectRun 5.0 frame %d' % i
+                for i in range(1, 5)])
+    dcss.send('stog_operation_completed collectRun 5.0 normal')
+    # read by someone else while the stream is not being iterated
+    client.process_until('stog_operation_completed collectRun')
+    assert [msg['arguments'] for msg in stream] == ['frame 3', 'frame 4', None]
+    assert client.message_filter == ((b'stog_become_master', ) +
+                                     client.internal_prefixes)
+
+
+def test_set_strings_pipelines_and_matches_by_name(connection):
+    client, dcss = connection
+    dcss.send('stog_set_string_completed run10 normal c',
+              'stog_set_string_completed run2 normal b',
+              'stog_set_string_completed run1 normal a')
+    results = client.set_strings({'run1': 'a', 'run2': 'b'})
+    assert dcss.received(2) == ['gtos_set_string run1 a',
+                                'gtos_set_string run2 b']
+    assert results == {'run1': 'stog_set_string_completed run1 normal a',
+                       'run2': 'stog_set_string_completed run2 normal b'}
+
+
+def test_overlapping_streams_keep_their_updates(connection):
+    client, dcss = connection
+    client.filter_messages('stog_become_master')
+    first = client.stream_operation('a')
+    second = client.stream_operation('b')
+    dcss.send('stog_operation_update a 5.0 a1')
+    assert next(first)['arguments'] == 'a1'
+    dcss.send('stog_operation_update b 5.1 b1')
+    assert next(second)['arguments'] == 'b1'
+    dcss.send('stog_operation_completed a 5.0 normal',
+              'stog_operation_update b 5.1 b2',
+              'stog_operation_completed b 5.1 normal')
+    assert [msg['arguments'] for msg in first] == [None]
+    assert [msg['arguments'] for msg in second] == ['b2', None]
+    assert client.kept_prefixes == {}
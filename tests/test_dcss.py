@@ -0,0 +1,180 @@
+import socket
+import threading
+
+import pytest
+
+from dcss.client import Client
+from dcss.dcss import DCSS, Disconnected, ReconnectPolicy
+
+
+def xos3(msg, data=b''):
+    msg = msg.encode('utf-8')
+    return b'%12d %12d %s%s' % (len(msg), len(data), msg, data)
+
+
+@pytest.fixture
+def connection():
+    ours, theirs = socket.socketpair()
+    dcss = DCSS(read_size=1024)
+    dcss.socket = ours
+    yield dcss, theirs
+    ours.close()
+    theirs.close()
+
+
+def test_buffer_grows_for_large_frames(connection):
+    dcss, peer = connection
+    payload = 'x' * 5000
+    peer.sendall(xos3(payload))
+    assert dcss.read_message() == (payload, '')
+    assert len(dcss.decoder.buffer) >= 5000
+
+
+def test_read_many_messages(connection):
+    dcss, peer = connection
+    messages = ['stog_configure_string run%d blctl inactive' % i
+                for i in range(50)]
+    peer.sendall(b''.join(xos3(msg) for msg in messages))
+    assert [dcss.read_message()[0] for _ in messages] == messages
+
+
+def test_read_message_with_data(connection):
+    dcss, peer = connection
+    peer.sendall(xos3('stog_login_complete 12', b'extra'))
+    assert dcss.read_message() == ('stog_login_complete 12', 'extra')
+
+
+def test_one_receive_queues_every_frame(connection):
+    dcss, peer = connection
+    peer.sendall(xos3('stog_become_master') + xos3('stog_other_master'))
+    assert dcss.read_message()[0] == 'stog_become_master'
+    assert list(dcss.frames) == [(b'stog_other_master', b'')]
+
+
+def test_reconnect_policy_delays():
+    policy = ReconnectPolicy(initial=0.1, maximum=0.4, jitter=0,
+                             max_attempts=5)
+    assert list(policy.delays()) == [0, 0.1, 0.2, 0.4, 0.4]
+    policy = ReconnectPolicy(initial=1, jitter=0.5, max_attempts=2)
+    assert 0.5 <= list(policy.delays())[1] <= 1
+
+
+def test_disconnect_raises_when_not_reconnecting(connection):
+    dcss, peer = connection
+    dcss.auto_reconnect = False
+    peer.close()
+    with pytest.raises(Disconnected):
+        dcss.read_message()
+    assert not dcss.is_connected
+
+
+def test_client_logs_in_again_after_disconnect():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+
+    def serve_twice():
+        for client_id in ('1', '2'):
+            sock, _ = listener.accept()
+            sock.sendall(xos3('stoc_send_client_type'))
+            sock.recv(200)
+            sock.sendall(xos3('stog_login_complete ' + client_id) +
+                         xos3('stog_become_master') +
+                         xos3('stog_configure_string runs self ' + client_id) +
+                         xos3('stog_dcss_end_update_all_device'))
+            if client_id == '1':
+                sock.close()
+            else:
+                sock.sendall(xos3('stog_other_master'))
+
+    server = threading.Thread(target=serve_twice)
+    server.start()
+    client = Client('127.0.0.1', 'abc')
+    client.port = listener.getsockname()[1]
+    client.process_until('stog_dcss_end_update_all_device')
+    assert client.get_string('runs') == '1'
+    client.process_until('stog_dcss_end_update_all_device')
+    assert client.client_id == '2'
+    assert client.ready and client.master
+    assert client.get_string('runs') == '2'
+    server.join()
+    client.close()
+    listener.close()
+
+
+def serve_dropping_first_request(listener):
+    # the first connection drops once the client asks something, the
+    # second never answers
+    for client_id in ('1', '2'):
+        sock, _ = listener.accept()
+        sock.sendall(xos3('stoc_send_client_type'))
+        sock.recv(200)
+        sock.sendall(xos3('stog_login_complete ' + client_id) +
+                     xos3('stog_dcss_end_update_all_device'))
+        # the request, then the client closing
+        sock.recv(200)
+        sock.close()
+
+
+@pytest.mark.parametrize('request_', [
+    lambda client: client.set_strings({'runs': '1'}, timeout=2),
+    lambda client: client.become_master(timeout=2),
+])
+def test_reply_lost_with_connection_raises(request_):
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    server = threading.Thread(target=serve_dropping_first_request,
+                              args=(listener, ))
+    server.start()
+    client = Client('127.0.0.1', 'abc')
+    client.port = listener.getsockname()[1]
+    with pytest.raises(Disconnected):
+        request_(client)
+    assert client.client_id == '2'
+    client.close()
+    server.join()
+    listener.close()
+
+
+def test_nul_terminated_messages(connection):
+    dcss, peer = connection
+    peer.sendall(xos3('stog_become_master\0'))
+    assert dcss.read_message() == ('stog_become_master', '')
+
+
+def test_subscribe_routes_by_prefix(connection):
+    dcss, peer = connection
+    seen = []
+    dcss.subscribe('stog_configure_', lambda msg: seen.append(('any', msg)))
+    dcss.subscribe('stog_configure_string run1 ',
+                   lambda msg: seen.append(('run1', msg)))
+    peer.sendall(xos3('stog_configure_string run1 self a') +
+                 xos3('stog_configure_string run10 self b') +
+                 xos3('stog_configure_shutter shutter host open') +
+                 xos3('stog_become_master'))
+    for _ in range(4):
+        dcss.read_message()
+    assert seen == [('any', 'stog_configure_string run1 self a'),
+                    ('run1', 'stog_configure_string run1 self a'),
+                    ('any', 'stog_configure_string run10 self b'),
+                    ('any', 'stog_configure_shutter shutter host open')]
+    assert dcss.routes['stog_become_master'] == ()
+
+
+def test_unsubscribe(connection):
+    dcss, peer = connection
+    seen = []
+    dcss.subscribe('stog_become_master', seen.append)
+    peer.sendall(xos3('stog_become_master'))
+    dcss.read_message()
+    dcss.unsubscribe('stog_become_master', seen.append)
+    peer.sendall(xos3('stog_become_master'))
+    dcss.read_message()
+    assert seen == ['stog_become_master']
+
+
+def test_send_does_not_connect():
+    dcss = DCSS('127.0.0.1', 1)
+    dcss.send_xos3('htos_operation_update centre 1.2 moving')
+    assert dcss.socket is None
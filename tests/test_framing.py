@@ -0,0 +1,58 @@
+import pytest
+
+from dcss.framing import FrameDecoder
+
+
+def xos1(msg):
+    return msg.ljust(200, b'\0')
+
+
+def xos3(msg, data=b''):
+    return b'%12d %12d %s%s' % (len(msg), len(data), msg, data)
+
+
+@pytest.fixture
+def decoder():
+    return FrameDecoder(read_size=16)
+
+
+def test_feed_returns_every_complete_frame(decoder):
+    stream = xos3(b'stog_become_master') + xos3(b'stog_login_complete 3', b'ab')
+    assert decoder.feed(stream) == [
+        (b'stog_become_master', b''),
+        (b'stog_login_complete 3', b'ab'),
+    ]
+    assert len(decoder) == 0
+
+
+def test_feed_byte_by_byte(decoder):
+    stream = xos3(b'stog_become_master') * 3
+    frames = []
+    for i in range(len(stream)):
+        frames.extend(decoder.feed(stream[i:i + 1]))
+    assert frames == [(b'stog_become_master', b'')] * 3
+
+
+def test_partial_frame_is_kept(decoder):
+    stream = xos3(b'stog_other_master')
+    assert decoder.feed(stream[:30]) == []
+    assert len(decoder) == 30
+    assert decoder.feed(stream[30:]) == [(b'stog_other_master', b'')]
+
+
+def test_xos1_then_xos3():
+    decoder = FrameDecoder(xos1_frames=1)
+    stream = xos1(b'stoc_send_client_type') + xos3(b'stoh_register_operation a')
+    assert decoder.feed(stream) == [
+        (b'stoc_send_client_type', b''),
+        (b'stoh_register_operation a', b''),
+    ]
+
+
+def test_get_buffer_and_buffer_updated(decoder):
+    stream = xos3(b'stog_dcss_end_update_all_device')
+    buf = decoder.get_buffer(len(stream))
+    buf[:len(stream)] = stream
+    assert decoder.buffer_updated(len(stream)) == [
+        (b'stog_dcss_end_update_all_device', b''),
+    ]
@@ -0,0 +1,86 @@
+import pytest
+
+from dcss.client import Client
+from dcss.dcss import Disconnected, ReconnectPolicy
+from dcss.hub import Hub
+
+
+@pytest.fixture
+def hub(connect):
+    hub = Hub()
+    peers = {}
+    for key in ('MX1', 'MX2'):
+        client = Client('localhost', 'abc')
+        peers[key] = connect(client)
+        hub.add(key, client)
+    yield hub, peers
+    hub.selector.close()
+
+
+def test_messages_are_routed_per_connection(hub):
+    hub, peers = hub
+    seen = []
+    hub.on_message(lambda key, client, msg: seen.append((key, msg)))
+    peers['MX1'].send('stog_configure_string runs self 1')
+    peers['MX2'].send('stog_configure_string runs self 2')
+    while len(seen) < 2:
+        hub.poll(1)
+    assert sorted(seen) == [('MX1', 'stog_configure_string runs self 1'),
+                            ('MX2', 'stog_configure_string runs self 2')]
+    assert hub.get_string('runs') == {'MX1': '1', 'MX2': '2'}
+
+
+def test_run_operation_on_every_connection(hub):
+    hub, peers = hub
+    futures = hub.run_operation('centre', 'fast')
+    for key, peer in peers.items():
+        assert peer.received(1) == ['gtos_start_operation centre 5.0 fast']
+        peer.send('stog_operation_completed centre 5.0 normal %s' % key)
+    results = hub.wait_for(futures.values())
+    assert sorted(results) == [
+        'stog_operation_completed centre 5.0 normal MX1',
+        'stog_operation_completed centre 5.0 normal MX2',
+    ]
+
+
+def test_dropped_connection_is_retried_without_blocking(hub):
+    hub, peers = hub
+    client = hub['MX1']
+    client.port = 1  # nothing listens here
+    client.reconnect_policy = ReconnectPolicy(initial=10, max_attempts=2)
+    peers['MX1'].socket.close()
+    hub.poll(1)
+    assert not client.is_connected
+    assert 'MX1' in hub.retrying
+    peers['MX2'].send('stog_become_master')
+    hub.poll(1)
+    assert hub['MX2'].master
+
+
+def test_run_operation_does_not_read(hub):
+    hub, peers = hub
+    seen = []
+    hub.on_message(lambda key, client, msg: seen.append((key, msg)))
+    hub['MX1'].master = False
+    peers['MX1'].send('stog_configure_string runs self 1')
+    futures = hub.run_operation('centre')
+    assert peers['MX1'].received(2) == ['gtos_become_master force',
+                                        'gtos_start_operation centre 5.0 ']
+    assert seen == []
+    peers['MX1'].send('stog_become_master',
+                      'stog_operation_completed centre 5.0 normal')
+    hub.wait_for([futures['MX1']])
+    assert ('MX1', 'stog_configure_string runs self 1') in seen
+    assert hub['MX1'].master
+
+
+def test_unreachable_connection_is_added_without_blocking():
+    hub = Hub(connect_timeout=0.5)
+    client = Client('127.0.0.1', 'abc')
+    client.port = 1  # nothing listens here
+    hub.add('MX3', client)
+    assert 'MX3' in hub.retrying
+    assert not client.is_connected
+    future = hub.run_operation('centre')['MX3']
+    assert isinstance(future.exception(), Disconnected)
+    hub.close()
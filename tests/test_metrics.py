@@ -0,0 +1,65 @@
+import pytest
+from mock import MagicMock
+
+from dcss.client import Client
+from dcss.metrics import Histogram, Metrics
+from dcss.server import OperationHandle
+
+
+@pytest.fixture
+def connection(connect):
+    client = Client('localhost', 'abc')
+    client.metrics = Metrics()
+    return client, connect(client)
+
+
+def test_histogram_buckets():
+    histogram = Histogram(buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.observe(value)
+    assert histogram.count == 4
+    assert histogram.sum == pytest.approx(2.65)
+    assert histogram.cumulative() == [(0.1, 2), (1, 3), (float('inf'), 4)]
+
+
+def test_client_counts_messages_and_times_operations(connection):
+    client, dcss = connection
+    dcss.send('stog_update_motor_position sample_x 1.0 normal',
+              'stog_operation_completed moveSample 5.0 normal done')
+    client.run_operation('moveSample', 1)
+    snapshot = client.metrics.snapshot()
+    assert snapshot['messages'] == {
+        'in': {'stog_update_motor_position': 1, 'stog_operation_completed': 1},
+        'out': {'gtos_start_operation': 1},
+    }
+    assert snapshot['bytes']['out'] == 26 + len('gtos_start_operation '
+                                                'moveSample 5.0 1')
+    assert snapshot['bytes']['in'] > 0
+    assert snapshot['operations_in_flight'] == 0
+    assert snapshot['operation_latency']['moveSample']['count'] == 1
+
+
+def test_server_operation_latency():
+    dcss = MagicMock()
+    dcss.metrics = Metrics()
+    OperationHandle(dcss, 'robot_config', '1.2').operation_completed('ok')
+    OperationHandle(dcss, 'robot_config', '1.3').operation_error('bad')
+    latency = dcss.metrics.snapshot()['operation_latency']
+    assert latency['robot_config']['count'] == 2
+
+
+def test_prometheus_text():
+    metrics = Metrics(buckets=(1, ))
+    metrics.message('out', 'gtos_become_master force', 50)
+    metrics.observe('moveSample', 0.5)
+    assert metrics.prometheus().splitlines() == [
+        '# TYPE dcss_messages_total counter',
+        'dcss_messages_total{direction="out",type="gtos_become_master"} 1',
+        '# TYPE dcss_bytes_total counter',
+        'dcss_bytes_total{direction="out"} 50',
+        '# TYPE dcss_operation_seconds histogram',
+        'dcss_operation_seconds_bucket{operation="moveSample",le="1.0"} 1',
+        'dcss_operation_seconds_bucket{operation="moveSample",le="+Inf"} 1',
+        'dcss_operation_seconds_sum{operation="moveSample"} 0.5',
+        'dcss_operation_seconds_count{operation="moveSample"} 1',
+    ]
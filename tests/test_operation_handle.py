@@ -31,3 +31,29 @@ def test_operation_update(operation):
     operation.operation_update('good', 'so', 'far')
     expected = call('htos_operation_update robot_config 123.45 good so far')
     assert operation.dcss.send_xos3.call_args == expected
+
+
+def test_operation_updates_are_coalesced():
+    dcss = MagicMock()
+    operation = OperationHandle(dcss, 'collectRun', '1.2', max_update_rate=10)
+    for i in range(5):
+        operation.operation_update('frame', i)
+    operation.operation_completed('done')
+    assert dcss.send_xos3.call_args_list == [
+        call('htos_operation_update collectRun 1.2 frame 0'),
+        call('htos_operation_update collectRun 1.2 frame 4'),
+        call('htos_operation_completed collectRun 1.2 normal done'),
+    ]
+    assert operation.timer is None
+
+
+def test_pending_update_is_sent_by_timer():
+    dcss = MagicMock()
+    operation = OperationHandle(dcss, 'collectRun', '1.2', max_update_rate=50)
+    operation.operation_update('frame', 0)
+    operation.operation_update('frame', 1)
+    timer = operation.timer
+    timer.join(1)
+    assert dcss.send_xos3.call_args == call(
+        'htos_operation_update collectRun 1.2 frame 1')
+    assert operation.pending_update is None
@@ -1,5 +1,8 @@
 # flake8: noqa
 
+import math
+from array import array
+
 import pytest
 
 from dcss import parse
@@ -227,3 +230,133 @@ def test_parse_start_robot_probe_message():
         ]
     }
     assert parse.parse_start_robot_probe_message(msg) == expected
+
+
+@pytest.mark.parametrize('msg,expected', [
+    (
+        'stog_start_operation robot_config 31.2 set_port_state mX0 u',
+        {'direction': 'stog', 'type': 'start_operation',
+         'name': 'robot_config', 'handle': '31.2', 'status': None,
+         'arguments': 'set_port_state mX0 u'}
+    ),
+    (
+        'stog_operation_update robot_config 31.38 port jam at m 3 A',
+        {'direction': 'stog', 'type': 'operation_update',
+         'name': 'robot_config', 'handle': '31.38', 'status': None,
+         'arguments': 'port jam at m 3 A'}
+    ),
+    (
+        'stog_operation_completed robot_config 31.41 aborted',
+        {'direction': 'stog', 'type': 'operation_completed',
+         'name': 'robot_config', 'handle': '31.41', 'status': 'aborted',
+         'arguments': None}
+    ),
+    (
+        'stog_set_string_completed runs normal 1 0 1',
+        {'direction': 'stog', 'type': 'set_string_completed',
+         'name': 'runs', 'handle': None, 'status': 'normal',
+         'arguments': '1 0 1'}
+    ),
+    (
+        'stog_configure_string runs blctl 1 0 1',
+        {'direction': 'stog', 'type': 'configure_string',
+         'name': 'runs', 'handle': None, 'status': None, 'owner': 'blctl',
+         'arguments': '1 0 1'}
+    ),
+    (
+        'stog_become_master',
+        {'direction': 'stog', 'type': 'become_master',
+         'name': None, 'handle': None, 'status': None, 'arguments': None}
+    ),
+])
+def test_parse_message(msg, expected):
+    expected.setdefault('owner', None)
+    expected['details'] = None
+    assert parse.parse_message(msg) == expected
+
+
+def test_parse_message_routes_robot_messages():
+    force = ('stog_set_string_completed robot_force_middle normal  -65.8  '
+             '0.0 uuuu 0.3 EEEE')
+    assert (parse.parse_message(force)['details'] ==
+            parse.parse_robot_force_message(force))
+    probe = ('stog_start_operation robot_config 31.41 probe ' +
+             '1 ' + '0 ' * 96 + '0 ' + '1 ' * 96 + '0 ' * 97)
+    details = parse.parse_message(probe, compact=True)['details']
+    assert list(details['holders'][1]['ports']) == [1] * 96
+    with pytest.raises(ValueError):
+        parse.parse_message('stog_set_string_completed robot_cassette normal')
+
+
+def test_parse_message_routes_configured_robot_strings():
+    force = ('stog_configure_string robot_force_left self normal -65.8 '
+             '0.0 uuuu 0.3 EEEE')
+    parsed = parse.parse_message(force)
+    assert parsed['owner'] == 'self'
+    assert parsed['details'] == {'position': 'left', 'status': 'normal',
+                                 'height': -65.8,
+                                 'forces': [0.0, 'unknown', 0.3, 'empty']}
+    cassette = ('stog_configure_string robot_cassette self normal ' +
+                'X ' + 'b ' * 96 + '3 ' + '1 j ' * 48 + 'u ' * 97)
+    details = parse.parse_message(cassette)['details']
+    assert details['status'] == 'normal'
+    assert [holder['type'] for holder in details['holders']] == [
+        'bad', 'puck adaptor', 'unknown']
+
+
+def test_parse_message_malformed():
+    with pytest.raises(ValueError):
+        parse.parse_message('stog_operation_completed robot_config 31.41')
+
+
+def test_parse_robot_force_message_compact():
+    msg = ('stog_set_string_completed robot_force_middle normal  -65.8  '
+           '0.0 uuuu 0.3 EEEE ')
+    parsed = parse.parse_robot_force_message(msg, compact=True)
+    forces = parsed['forces']
+    assert forces.typecode == 'd'
+    assert forces[0] == 0.0 and forces[2] == 0.3
+    assert math.isnan(forces[1]) and math.isnan(forces[3])
+    assert parsed['height'] == -65.8
+
+
+def test_parse_robot_cassette_message_compact():
+    msg = ('stog_set_string_completed robot_cassette normal ' +
+           'X ' + 'b ' * 96 + '3 ' + '1 j ' * 48 + 'u ' * 97)
+    parsed = parse.parse_robot_cassette_message(msg, compact=True)
+    assert parsed['status'] == 'normal'
+    assert [holder['type'] for holder in parsed['holders']] == [
+        'bad', 'puck adaptor', 'unknown']
+    assert parsed['holders'][1]['ports'] == b'1j' * 48
+
+
+def test_parse_start_robot_probe_message_compact():
+    msg = ('stog_start_operation robot_config 31.41 probe ' +
+           '1 ' + '0 ' * 96 + '0 ' + '1 ' * 96 + '0 ' * 97)
+    parsed = parse.parse_start_robot_probe_message(msg, compact=True)
+    ports = parsed['holders'][1]['ports']
+    assert ports.typecode == 'b'
+    assert list(ports) == [1] * 96
+    assert parsed['holders'][0]['probe_holder_type'] == 1
+
+
+@pytest.mark.parametrize('bad', ['12', 'x', '-1'])
+def test_parse_start_robot_probe_message_compact_rejects_bad_values(bad):
+    msg = ('stog_start_operation robot_config 31.41 probe ' +
+           bad + ' ' + '0 ' * 290)
+    with pytest.raises(ValueError):
+        parse.parse_start_robot_probe_message(msg, compact=True)
+    with pytest.raises(ValueError):
+        parse.parse_start_robot_probe_message(msg.rsplit(' ', 2)[0],
+                                              compact=True)
+
+
+def test_diff_ports():
+    assert parse.diff_ports(b'11j-', b'11j-') == []
+    assert parse.diff_ports(b'11j-', b'10j1') == [1, 3]
+    nan = float('nan')
+    old = array('d', [0.1, nan, nan, 0.3])
+    new = array('d', [0.1, nan, 0.2, nan])
+    assert parse.diff_ports(old, new) == [2, 3]
+    with pytest.raises(ValueError):
+        parse.diff_ports(b'11', b'111')
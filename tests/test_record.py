@@ -0,0 +1,75 @@
+import pytest
+from mock import MagicMock
+
+from dcss.client import Client
+from dcss.record import RECEIVED, SENT, Recorder, read_records, replay
+from dcss.server import Server
+
+
+@pytest.fixture
+def recording(tmpdir, connect):
+    path = str(tmpdir.join('session.rec'))
+    client = Client('localhost', 'abc')
+    dcss = connect(client)
+    with Recorder(path) as recorder:
+        client.recorder = recorder
+        dcss.send('stog_configure_string runs self 1 0 1',
+                  'stog_dcss_end_update_all_device')
+        client.process_until('stog_dcss_end_update_all_device')
+        client.send_xos3('gtos_set_string runs 2 0 1')
+    return path
+
+
+def test_read_records(recording):
+    records = [(direction, msg) for _, direction, msg, _ in
+               read_records(recording)]
+    assert records == [
+        (RECEIVED, b'stog_configure_string runs self 1 0 1'),
+        (RECEIVED, b'stog_dcss_end_update_all_device'),
+        (SENT, b'gtos_set_string runs 2 0 1'),
+    ]
+
+
+def test_frames_are_recorded_as_received(tmpdir, connect):
+    path = str(tmpdir.join('session.rec'))
+    client = Client('localhost', 'abc')
+    dcss = connect(client)
+    with Recorder(path) as recorder:
+        client.recorder = recorder
+        dcss.send('stog_become_master', 'stog_other_master')
+        client.receive()
+        # flushed, though neither frame has been read yet
+        assert [msg for _, _, msg, _ in read_records(path)] == [
+            b'stog_become_master', b'stog_other_master']
+
+
+def test_replay_into_client(recording):
+    client = Client('localhost', 'abc')
+    count, seconds = replay(recording, client)
+    assert count == 2
+    assert client.ready
+    assert client.get_string('runs') == '1 0 1'
+
+
+def test_replay_into_server_does_not_run_handlers(tmpdir):
+    path = str(tmpdir.join('dhs.rec'))
+    with Recorder(path) as recorder:
+        recorder.record(RECEIVED, b'stoh_start_operation home 1.2')
+
+    class MyDHS(Server):
+        home = MagicMock()
+
+    dhs = MyDHS('my_dhs', 'localhost')
+    seen = []
+    dhs.subscribe('stoh_start_operation ', seen.append)
+    assert replay(path, dhs)[0] == 1
+    assert seen == ['stoh_start_operation home 1.2']
+    assert not MyDHS.home.called
+    assert dhs.executor.active_workers == 0
+
+
+def test_not_a_recording(tmpdir):
+    path = tmpdir.join('other')
+    path.write('nope')
+    with pytest.raises(ValueError):
+        list(read_records(str(path)))
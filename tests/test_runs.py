@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+
+from dcss.dcss import Timeout
+from dcss.runs import RUN_KEYS, RunRecord, Runs
+
+RUN1 = ('inactive 0 1 test /data/test 1 Phi 0.0 180.0 1.0 180 1.0 300.0 '
+        '40.0 0.0 1 12658.0 0.0 0.0 0.0 0.0 0 0')
+
+
+@pytest.fixture
+def connection(connect):
+    runs = Runs('localhost', 'abc')
+    dcss = connect(runs)
+    dcss.send('stog_configure_string runs self 2 0 1',
+              'stog_configure_string run1 self ' + RUN1,
+              'stog_configure_string run2 self ' + RUN1,
+              'stog_dcss_end_update_all_device')
+    runs.process_until('stog_dcss_end_update_all_device')
+    return runs, dcss
+
+
+def test_run_record():
+    record = RunRecord.from_string(RUN1)
+    assert record['status'] == 'inactive'
+    assert record.get('directory') == '/data/test'
+    assert record.keys() == RUN_KEYS
+    assert record.to_string() == RUN1
+    updated = record.updated(prefix='new', delta=None, bogus=1)
+    assert updated.file_root == 'new'
+    assert updated.delta == '1.0'
+    assert record.file_root == 'test'
+    with pytest.raises(KeyError):
+        record['bogus']
+
+
+def test_runs_are_parsed(connection):
+    runs, _ = connection
+    assert runs.runs['runs'] == ['2', '0', '1']
+    assert runs.runs['run1'] == RunRecord.from_string(RUN1)
+
+
+def test_set_run_without_changes_sends_nothing(connection):
+    runs, _ = connection
+    assert runs.set_run('run1', exposure_time='1.0') is False
+
+
+def test_batch_sends_changed_runs_together(connection):
+    runs, dcss = connection
+    expected = {
+        'run1': RUN1.replace(' 1.0 300.0', ' 2.0 300.0'),
+        'run2': RUN1.replace(' test ', ' other '),
+    }
+    dcss.send(*['stog_set_string_completed %s normal %s' % item
+                for item in sorted(expected.items())])
+    with runs.batch() as batch:
+        batch.set_run('run1', exposure_time=2.0)
+        batch.set_run('run2', prefix='other')
+    assert sorted(dcss.received(2)) == [
+        'gtos_set_string %s %s' % item for item in sorted(expected.items())]
+    assert runs.runs['run1'].exposure_time == '2.0'
+    assert runs.runs['run2'].file_root == 'other'
+
+
+def test_reset_runs_are_pipelined(connection):
+    runs, dcss = connection
+    dcss.send('stog_operation_completed runsConfig 5.1 normal',
+              'stog_operation_completed runsConfig 5.0 error busy')
+    results = runs.reset_runs([3, 4])
+    assert dcss.received(2) == [
+        'gtos_start_operation runsConfig 5.0 blctl resetRun 3',
+        'gtos_start_operation runsConfig 5.1 blctl resetRun 4',
+    ]
+    assert results == {
+        3: 'stog_operation_completed runsConfig 5.0 error busy',
+        4: 'stog_operation_completed runsConfig 5.1 normal',
+    }
+
+
+def test_set_run_only_waits_for_its_run(connect):
+    runs = Runs('localhost', 'abc')
+    dcss = connect(runs)
+    changed = RUN1.replace(' test ', ' other ')
+    dcss.send('stog_configure_string run1 self ' + RUN1,
+              'stog_set_string_completed run1 normal ' + changed)
+    assert runs.set_run('run1', prefix='other', timeout=1)
+    assert not runs.ready
+    assert dcss.received(1) == ['gtos_set_string run1 ' + changed]
+
+
+def test_needs_stops_waiting_after_the_dump(connect):
+    runs = Runs('localhost', 'abc')
+    dcss = connect(runs)
+    dcss.send('stog_configure_string runs self 1 0 1',
+              'stog_dcss_end_update_all_device')
+    runs.wait_for_devices(['runs', 'missing'], timeout=1)
+    assert runs.ready
+
+
+def test_decorated_methods_accept_timeout(connection):
+    runs, dcss = connection
+    assert runs.return_runs(timeout=1) is runs.runs
+    runs.show_if_hidden(0, timeout=1)
+
+
+def test_reset_runs_timeout_covers_becoming_master(connection):
+    runs, dcss = connection
+    runs.master = False
+    start = time.monotonic()
+    with pytest.raises(Timeout):
+        runs.reset_runs([1, 2], timeout=0.2)
+    assert time.monotonic() - start < 0.5
+
+
+def test_set_runs_timeout_covers_the_whole_call(connect):
+    runs = Runs('localhost', 'abc')
+    dcss = connect(runs)
+    # run1 arrives late and the set is never completed
+    timer = threading.Timer(0.2, dcss.send,
+                            ['stog_configure_string run1 self ' + RUN1])
+    timer.start()
+    start = time.monotonic()
+    with pytest.raises(Timeout):
+        runs.set_runs({'run1': {'prefix': 'other'}}, timeout=0.3)
+    assert time.monotonic() - start < 0.45
+    timer.join()
@@ -0,0 +1,126 @@
+import threading
+
+from mock import MagicMock
+
+from dcss.metrics import Metrics
+from dcss.server import OperationExecutor, Server, in_process
+
+
+def test_executor_limits_operation_concurrency():
+    executor = OperationExecutor(max_workers=4, limits={'slow': 1})
+    release = threading.Event()
+    done = []
+
+    def slow(tag):
+        release.wait(5)
+        done.append(tag)
+
+    assert executor.submit('slow', slow, 1)
+    assert executor.submit('slow', slow, 2)
+    assert executor.active_workers == 1
+    assert executor.queue_depth == 1
+    release.set()
+    executor.shutdown()
+    assert done == [1, 2]
+    assert executor.active_workers == 0
+    assert executor.queue_depth == 0
+    assert executor.running == {}
+
+
+def test_executor_rejects_when_queue_is_full():
+    executor = OperationExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+    assert executor.submit('a', release.wait, 5)
+    assert executor.submit('a', release.wait, 5)
+    assert not executor.submit('a', release.wait, 5)
+    release.set()
+    executor.shutdown()
+
+
+def test_server_reports_busy_when_queue_is_full():
+    class MyDHS(Server):
+        def home(self, operation):
+            pass
+
+    executor = MagicMock()
+    executor.submit.return_value = False
+    dhs = MyDHS('my_dhs', 'localhost', executor=executor)
+    dhs.send_xos3 = MagicMock()
+    dhs.stoh_start_operation('home', '1.2')
+    dhs.send_xos3.assert_called_once_with(
+        'htos_operation_completed home 1.2 error busy')
+
+
+def test_failed_operation_completes_with_error(connect):
+    class MyDHS(Server):
+        def home(self, operation):
+            operation.operation_update('moving')
+            raise RuntimeError('stuck')
+
+    dhs = MyDHS('my_dhs', 'localhost')
+    dcss = connect(dhs)
+    dhs.handle_message('stoh_start_operation home 1.2')
+    assert dcss.received(2) == ['htos_operation_update home 1.2 moving',
+                                'htos_operation_completed home 1.2 error stuck']
+    dhs.executor.shutdown()
+
+
+def test_handle_message_dispatch_and_unhandled_counts():
+    class MyDHS(Server):
+        def stoh_register_operation(self, *args):
+            self.registered.append(args)
+
+    dhs = MyDHS('my_dhs', 'localhost')
+    dhs.registered = []
+    dhs.handle_message('stoh_register_operation centre centre')
+    dhs.handle_message('stog_update_motor_position sample_x 1.0 normal')
+    dhs.handle_message('stog_update_motor_position sample_y 2.0 normal')
+    dhs.handle_message('')
+    assert dhs.registered == [('centre', 'centre')]
+    assert dhs.unhandled == {'stog_update_motor_position': 2}
+    assert 'stoh_start_operation' in dhs.handlers
+
+
+class ProcessDHS(Server):
+    @staticmethod
+    @in_process
+    def square(operation, value):
+        operation.operation_update('working')
+        operation.operation_completed(int(value) ** 2)
+
+
+def test_in_process_operations(connect):
+    dhs = ProcessDHS('my_dhs', 'localhost')
+    dhs.metrics = Metrics()
+    dcss = connect(dhs)
+    dhs.handle_message('stoh_start_operation square 1.2 7')
+    assert dcss.received(2) == ['htos_operation_update square 1.2 working',
+                                'htos_operation_completed square 1.2 normal 49']
+    dhs.executor.shutdown()
+    latency = dhs.metrics.snapshot()['operation_latency']
+    assert latency['square']['count'] == 1
+    processes = dhs.processes
+    dhs.close()
+    assert dhs.processes is None
+    assert not processes.relay.is_alive()
+
+
+def test_failed_in_process_operation_completes_with_error(connect):
+    dhs = ProcessDHS('my_dhs', 'localhost')
+    dcss = connect(dhs)
+    dhs.handle_message('stoh_start_operation square 1.2 seven')
+    update, msg = dcss.received(2)
+    assert msg.startswith('htos_operation_completed square 1.2 error ')
+    dhs.close()
+
+
+def test_in_process_operations_are_admitted_by_the_executor():
+    executor = MagicMock()
+    executor.submit.return_value = False
+    dhs = ProcessDHS('my_dhs', 'localhost', executor=executor)
+    dhs.send_xos3 = MagicMock()
+    dhs.stoh_start_operation('square', '1.2', '7')
+    dhs.send_xos3.assert_called_once_with(
+        'htos_operation_completed square 1.2 error busy')
+    assert executor.submit.call_args[0][:2] == ('square', dhs.processes.run)
+    dhs.close()
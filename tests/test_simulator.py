@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+from dcss.client import Client
+from dcss.runs import Runs
+from dcss.server import Server
+from dcss.simulator import Simulator
+
+
+@pytest.fixture
+def simulator():
+    with Simulator(gui_port=0, hardware_port=0,
+                   operation_owners={'centre': 'sim_dhs'}) as simulator:
+        yield simulator
+
+
+def gui(simulator, cls=Client):
+    client = cls('127.0.0.1', 'abc')
+    client.port = simulator.gui_port
+    client.timeout = 5
+    return client
+
+
+class SimDHS(Server):
+    def centre(self, operation, *args):
+        operation.operation_update('moving')
+        operation.operation_completed('centred', *args)
+
+
+def test_gui_login_dump_and_operations(simulator):
+    runs = gui(simulator, Runs)
+    assert runs.run_operation('moveSample', 1).startswith(
+        'stog_operation_completed moveSample 1.0 normal')
+    assert runs.ready
+    assert runs.runs['runs'] == ['0', '0', '1']
+    assert runs.state.motors['sample_x']['position'] == 0.0
+    assert runs.set_run('run0', prefix='sim')
+    assert simulator.strings['run0'].split()[3] == 'sim'
+    runs.close()
+
+
+def test_master_moves_between_guis(simulator):
+    first, second = gui(simulator), gui(simulator)
+    assert first.become_master(timeout=5)
+    assert second.become_master(timeout=5)
+    first.process_until('stog_other_master', timeout=5)
+    assert not first.master
+    first.close()
+    second.close()
+
+
+def test_operations_are_forwarded_to_hardware(simulator):
+    dhs = SimDHS('sim_dhs', '127.0.0.1')
+    dhs.port = simulator.hardware_port
+    dhs.connect()
+    thread = threading.Thread(target=dhs.loop)
+    thread.daemon = True
+    thread.start()
+    assert simulator.wait_for_hardware('sim_dhs', timeout=5)
+
+    client = gui(simulator)
+    result = client.run_operation('centre', 'fast')
+    assert result == 'stog_operation_completed centre 1.0 normal centred fast'
+
+    simulator.flood_operations('sim_dhs', 'centre', 50)
+    assert simulator.wait_for_completed(51, timeout=5)
+    client.close()
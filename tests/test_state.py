@@ -0,0 +1,39 @@
+from dcss.state import DeviceState
+
+
+def test_strings_and_change_notifications():
+    state = DeviceState()
+    changes = []
+    state.on_change(lambda *change: changes.append(change))
+    assert state.apply('stog_configure_string runs self 1 0 1')
+    assert state.apply('stog_set_string_completed runs normal 2 0 1')
+    assert not state.apply('stog_set_string_completed runs normal 2 0 1')
+    assert state.strings == {'runs': '2 0 1'}
+    assert changes == [('strings', 'runs', '1 0 1'),
+                       ('strings', 'runs', '2 0 1')]
+
+
+def test_motors():
+    state = DeviceState()
+    state.apply('stog_configure_real_motor sample_x dhs sample_x 1.5 10 -10 '
+                '1000 100 0.1 0 1 1 0 0 0')
+    assert state.motors['sample_x'] == {'position': 1.5, 'status': 'normal'}
+    state.apply('stog_update_motor_position sample_x 2.25 moving')
+    assert state.motors['sample_x'] == {'position': 2.25, 'status': 'moving'}
+
+
+def test_operations():
+    state = DeviceState()
+    state.apply('stog_start_operation robot_config 31.2 probe')
+    assert state.operations['robot_config'] == {
+        'handle': '31.2', 'status': 'active', 'arguments': 'probe'}
+    state.apply('stog_operation_completed robot_config 31.2 normal ok')
+    assert state.operations['robot_config'] == {
+        'handle': '31.2', 'status': 'normal', 'arguments': 'ok'}
+
+
+def test_ignores_other_and_malformed_messages():
+    state = DeviceState()
+    assert not state.apply('stog_become_master')
+    assert not state.apply('stog_update_motor_position sample_x')
+    assert state.motors == {}